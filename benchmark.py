@@ -0,0 +1,351 @@
+import os
+import sys
+import json
+import time
+import difflib
+import argparse
+import tempfile
+import threading
+import tracemalloc
+import http.server
+import code
+
+
+class FakeSpeechResponse(object):
+    def __init__(self, audio_bytes):
+        self.audio_bytes = audio_bytes
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+    def iter_bytes(self, chunk_size=1024):
+        chunk = b'\xff' * chunk_size
+        for _ in range(self.audio_bytes // chunk_size):
+            yield chunk
+
+
+class FakeSpeechClient(object):
+    # Mimics client.audio.speech, tts-1 produces roughly 100 bytes of 48kbps MP3 per character
+    def __init__(self, bytes_per_char=100):
+        self.bytes_per_char = bytes_per_char
+        self.audio = self
+        self.speech = self
+        self.with_streaming_response = self
+
+    def create(self, model, voice, input, **kwargs):
+        return FakeSpeechResponse(len(input) * self.bytes_per_char)
+
+
+def measure(function, *args):
+    tracemalloc.start()
+    start = time.perf_counter()
+    function(*args)
+    seconds = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return seconds, peak
+
+
+def legacy_concatenate(client, file, text_chunks):
+    audio = bytes()
+    for chunk in text_chunks:
+        response = client.audio.speech.create(model="tts-1", voice='alloy', input=chunk)
+        for byte in response.iter_bytes():
+            audio = audio + byte
+    with open(file=file, mode='wb') as file:
+        file.write(audio)
+
+
+def synthetic_article(sections=200):
+    # Shaped like a help.salesforce.com article body once create_flashcard_dicts has flattened it
+    html = '<h1 id="title"><span>Set Up Your Org</span></h1>'
+    for section in range(sections):
+        html += (f'<h2 id="section-{section}"><span>Section {section}</span></h2>'
+                 f'<p>Salesforce lets admins control <b>who sees what</b> with profiles, permission sets and <a href="https://help.salesforce.com/s/articleView?id={section}">sharing rules</a>. '
+                 f'Each of these settings is evaluated on every request.</p><br/><img src="https://res.cloudinary.com/{section}.png" alt="Diagram"><br/>'
+                 f'<ul><li><p>First step for section {section}.</p></li><li><p>Second step with <code>System.debug()</code>.</p></li></ul>'
+                 f'<table><tbody><tr><td>Field</td><td>Value&nbsp;{section}</td></tr></tbody></table>'
+                 f'<div class="box message info"><div class="inner"><p>Note: changes may take a few minutes.</p></div></div>')
+    return html
+
+
+def benchmark_parsing(sections=(50, 200, 800)):
+    for count in sections:
+        html = code.add_br_around_img_tags(synthetic_article(count))
+        start = time.perf_counter()
+        trees = code.parse_trees(html)
+        parsed = time.perf_counter()
+        flashcards = code.convert_trees_to_dicts(trees, split_on_trees=False, try_split_after=500)
+        converted = time.perf_counter()
+        print(f'{count} sections ({len(html) / 1024:.0f} KB, {len(flashcards)} cards): parse_trees {parsed - start:.3f}s, '
+              f'convert_trees_to_dicts {converted - parsed:.3f}s, {len(html) / 1024 / 1024 / (converted - start):.1f} MB/s')
+
+
+class FixtureHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    pages = {}
+    latency = 0.0
+
+    def do_GET(self):
+        time.sleep(self.latency)
+        body = self.pages.get(self.path, '<html><body><div id="app"></div></body></html>').encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_fixtures(pages, latency=0.0):
+    FixtureHandler.pages = pages
+    FixtureHandler.latency = latency
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), FixtureHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_port}'
+
+
+def synthetic_unit_page(index):
+    return (f'<html><body><nav><ol><li><a href="/trail">Admin Beginner</a></li><li><a href="/module">Data Security</a></li><li>Unit {index}</li></ol></nav>'
+            f'<article><h1>Control Access to Records {index}</h1><div class="unit-content">{synthetic_article(5)}</div></article></body></html>')
+
+
+def benchmark_http_fetch(units=100, workers=(1, 8), latency=0.05):
+    # latency stands in for the round trip to trailhead.salesforce.com
+    pages = {f'/unit-{index}': synthetic_unit_page(index) for index in range(units)}
+    server, base_url = serve_fixtures(pages, latency)
+    try:
+        for worker_count in workers:
+            fetcher = code.HttpUnitFetcher([{'name': 'sid', 'value': 'benchmark', 'domain': '127.0.0.1', 'path': '/'}], workers=worker_count)
+            start = time.perf_counter()
+            results = fetcher.fetch_all([f'{base_url}{path}' for path in pages] + [f'{base_url}/client-rendered'])
+            seconds = time.perf_counter() - start
+            assert all(result is not None for result in results[:-1]) and results[-1] is None
+            print(f'{units} unit pages over HTTP with {worker_count} workers: {seconds:.3f}s ({units / seconds:.0f} pages/s)')
+    finally:
+        server.shutdown()
+
+
+def benchmark_speech_writes(unit_chars=(2000, 8000, 20000)):
+    speaker = code.Speaker('OpenAI', open_ai_key='benchmark')
+    speaker.backend.client = FakeSpeechClient()
+    with tempfile.TemporaryDirectory() as directory:
+        for chars in unit_chars:
+            text = ('This sentence stands in for a long Trailhead unit. ' * (chars // 51 + 1))[:chars]
+            text_chunks = [text[i:i + 4096] for i in range(0, len(text), 4096)]
+            legacy_seconds, legacy_peak = measure(legacy_concatenate, speaker.backend.client, os.path.join(directory, 'legacy.mp3'), text_chunks)
+            streamed_seconds, streamed_peak = measure(speaker.generate_speech, os.path.join(directory, 'streamed.mp3'), text)
+            megabytes = os.path.getsize(os.path.join(directory, 'streamed.mp3')) / 1024 / 1024
+            print(f'{chars} chars ({megabytes:.1f} MB): concatenate {legacy_seconds:.3f}s / {legacy_peak / 1024 / 1024:.1f} MB peak, '
+                  f'stream {streamed_seconds:.3f}s / {streamed_peak / 1024 / 1024:.1f} MB peak')
+
+
+def benchmark_chunking(sections=(50, 200), budgets=(4096, 1000, 200)):
+    # Long help.salesforce.com style cards cut to each backend budget, no text may be lost or go over budget
+    for count in sections:
+        flashcards = code.convert_trees_to_dicts(code.parse_trees(code.add_br_around_img_tags(synthetic_article(count))), split_on_trees=False, try_split_after=100000)
+        text = max((flashcard['text'] for flashcard in flashcards), key=len)
+        for budget in budgets:
+            start = time.perf_counter()
+            text_chunks = code.chunk_text(text, budget)
+            seconds = time.perf_counter() - start
+            assert all(len(chunk) <= budget for chunk in text_chunks)
+            assert ' '.join(text_chunks).split() == text.split()
+            sentences = sum(chunk.endswith(('.', '!', '?')) for chunk in text_chunks)
+            print(f'{len(text)} chars into {budget} char chunks: {len(text_chunks)} chunks, {sentences} ending on a sentence, {seconds * 1000:.1f}ms')
+
+
+def synthetic_flashcards(count=200):
+    # Mostly unit cards with a short Exam Weight style card every tenth one
+    flashcards = []
+    for index in range(count):
+        text = 'Exam Weight: 10%' if index % 10 == 0 else ('Profiles and permission sets decide who sees which records. ' * 8) + str(index)
+        flashcards.append({'trail_title': 'Admin Beginner', 'module_title': 'Data Security', 'module_index': '1', 'unit_title': f'Unit {index // 5}',
+                           'unit_index': str(index // 5), 'card_index': str(index % 5 + 1), 'text': text, 'html': f'<p>{text}</p>'})
+    return flashcards
+
+
+def benchmark_flashcard_writer(count=200, workers=(1, 4, 16), latency=0.02, batch_size=8):
+    # The FlashcardWriter path end to end against the fake backend, latency stands in for one TTS request
+    flashcards = synthetic_flashcards(count)
+    for worker_count in workers:
+        for ssml_batch_size in (0, batch_size):
+            with tempfile.TemporaryDirectory() as directory:
+                speaker = code.Speaker('Fake', fake_latency=latency, ssml_batch_size=ssml_batch_size)
+                writer = code.FlashcardWriter(f'{directory}/', f'{directory}/', speaker, None, worker_count)
+                start = time.perf_counter()
+                for activity_start in range(0, count, 5):
+                    writer.add(flashcards[activity_start:activity_start + 5])
+                writer.close()
+                seconds = time.perf_counter() - start
+                print(f'{count} cards with {worker_count} TTS workers{f" and batches of {ssml_batch_size}" if ssml_batch_size else ""}: {seconds:.2f}s '
+                      f'({count / seconds:.0f} cards/s, {speaker.backend.requests} requests)')
+
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+
+class FixtureElement(object):
+    def __init__(self, text=''):
+        self.text = text
+
+    def is_displayed(self):
+        return True
+
+    def is_enabled(self):
+        return True
+
+
+class FixtureDriver(object):
+    # Stands in for the Chrome driver, answering each extraction script from the recorded pages in fixtures/site.json
+    def __init__(self, directory=FIXTURES_DIR):
+        self.directory = directory
+        with open(os.path.join(directory, 'site.json'), encoding='utf-8') as file:
+            self.site = json.load(file)
+        self.current_url = 'about:blank'
+        self.pages = {}
+
+    def page(self, section, url):
+        if url not in self.pages:
+            with open(os.path.join(self.directory, self.site[section][url]), encoding='utf-8') as file:
+                self.pages[url] = file.read()
+        return self.pages[url]
+
+    def get(self, url):
+        self.current_url = url
+
+    def find_element(self, by, selector):
+        if selector == 'h1' and self.current_url in self.site['modules']:
+            return FixtureElement(self.site['modules'][self.current_url]['title'])
+        if selector == 'article > h1' and self.current_url not in self.site['units']:
+            raise code.StaleElementReferenceException(f'No unit fixture for {self.current_url}')
+        return FixtureElement()
+
+    def find_elements(self, by, selector):
+        if selector == '.tds-content-panel__unit' and self.current_url in self.site['modules']:
+            return [FixtureElement(unit) for unit in self.site['modules'][self.current_url]['units']]
+        return []
+
+    def execute_script(self, script, *args):
+        if script == code.TRAIL_EXTRACTION_SCRIPT:
+            return self.site['trails'][self.current_url]
+        if script == code.MODULE_UNIT_LINKS_SCRIPT:
+            return self.site['modules'][self.current_url]['units']
+        if script == code.UNIT_EXTRACTION_SCRIPT:
+            # The same parser as the HTTP fast path, so a unit comes out as it would from the live page
+            parser = code.UnitPageParser(self.page('units', self.current_url))
+            parser.feed(parser.page)
+            parser.close()
+            return {'title': parser.title.strip(), 'html': parser.page[parser.content_start:parser.content_end], 'breadcrumbs': [breadcrumb.strip() for breadcrumb in parser.breadcrumbs], 'challenge': parser.challenge, 'url': self.current_url}
+        if script == code.ARTICLE_EXTRACTION_SCRIPT:
+            return {'html': self.page('articles', self.current_url), 'challenge': False, 'url': self.current_url}
+        if script == 'return navigator.userAgent':
+            return 'FixtureDriver'
+        raise Exception(f'FixtureDriver has no answer for script: {script[:60]}')
+
+    def execute_async_script(self, script, *args):
+        return 0
+
+    def execute_cdp_cmd(self, command, parameters):
+        return {'cookies': []}
+
+    def quit(self):
+        pass
+
+
+def fixture_pages(directory=FIXTURES_DIR):
+    driver = FixtureDriver(directory)
+    pages = []
+    for url in driver.site['units']:
+        driver.get(url)
+        pages.append(driver.execute_script(code.UNIT_EXTRACTION_SCRIPT))
+    for url in driver.site['articles']:
+        driver.get(url)
+        pages.append(dict(driver.execute_script(code.ARTICLE_EXTRACTION_SCRIPT), title='Article'))
+    return pages
+
+
+def benchmark_fixture_stages(repeat=200):
+    # Each stage of create_flashcard_dicts over every recorded page, repeated so the timings are above timer noise
+    pages = fixture_pages()
+    html = [code.STRIP_RULES.strip(code.WHITESPACE_RUN_PATTERN.sub('', page['html'].replace('\n', ''))) for page in pages]
+    with_br = [code.add_br_around_img_tags(page) for page in html]
+    trees = [code.parse_trees(page) for page in with_br]
+    megabytes = sum(len(page['html']) for page in pages) * repeat / 1024 / 1024
+    stages = [
+        ('add_br_around_img_tags', lambda: [code.add_br_around_img_tags(page) for page in html]),
+        ('parse_trees', lambda: [code.parse_trees(page) for page in with_br]),
+        ('convert_trees_to_dicts', lambda: [code.convert_trees_to_dicts(page_trees, split_on_trees=False, try_split_after=500) for page_trees in trees]),
+        ('create_flashcard_dicts', lambda: [code.create_flashcard_dicts('Trail', 'Module', page['title'], page['html'], 500) for page in pages])
+    ]
+    for name, function in stages:
+        seconds, peak = measure(lambda: [function() for _ in range(repeat)])
+        print(f'{name}: {len(pages) * repeat} pages in {seconds:.3f}s, {megabytes / seconds:.1f} MB/s, {peak / 1024:.0f} KB peak')
+
+
+def run_fixture_pipeline(output_dir, audio_dir, directory=FIXTURES_DIR, split_after=60):
+    # Every source in fixtures/site.json through scrape_sources with the stub driver and the fake TTS backend. The
+    # recorded units are short, a lower split_after makes sure splitting between sections is covered too.
+    driver = FixtureDriver(directory)
+    previous_browser, code.browser = code.browser, driver
+    try:
+        speaker = code.Speaker('Fake')
+        return code.scrape_sources(driver.site['sources'], output_dir, audio_dir, speaker, split_after)
+    finally:
+        code.browser = previous_browser
+
+
+def benchmark_fixture_pipeline(update_expected=False, directory=FIXTURES_DIR):
+    # Compares every CSV with fixtures/expected, update_expected records the current output as the new expectation
+    expected_dir = os.path.join(directory, 'expected')
+    with tempfile.TemporaryDirectory() as output_dir:
+        seconds, peak = measure(run_fixture_pipeline, f'{output_dir}/', f'{output_dir}/', directory)
+        csv_files = sorted(file for file in os.listdir(output_dir) if file.endswith('.csv'))
+        cards = 0
+        differences = []
+        for csv_file in csv_files:
+            with open(os.path.join(output_dir, csv_file), encoding='utf-8') as file:
+                rows = file.readlines()
+            cards += len(rows)
+            expected_file = os.path.join(expected_dir, csv_file)
+            if update_expected:
+                with open(expected_file, mode='w', encoding='utf-8') as file:
+                    file.writelines(rows)
+                continue
+            expected_rows = []
+            if os.path.isfile(expected_file):
+                with open(expected_file, encoding='utf-8') as file:
+                    expected_rows = file.readlines()
+            differences.extend(difflib.unified_diff(expected_rows, rows, f'expected/{csv_file}', csv_file))
+        missing = [file for file in sorted(os.listdir(expected_dir)) if file.endswith('.csv') and file not in csv_files]
+    print(f'Fixture pipeline: {len(csv_files)} CSVs, {cards} cards in {seconds:.3f}s ({cards / seconds:.0f} cards/s), {peak / 1024 / 1024:.1f} MB peak')
+    if update_expected:
+        print(f'Recorded {len(csv_files)} expected CSVs in {expected_dir}')
+        return True
+    for file in missing:
+        print(f'Missing output: {file}')
+    if differences:
+        sys.stdout.writelines(differences)
+    print('Card output matches the fixtures.' if not differences and not missing else 'Card output differs from the fixtures!')
+    return not differences and not missing
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Offline benchmarks, nothing here needs a browser, a login or the network.')
+    parser.add_argument('--fixtures-only', action='store_true', help='only run the recorded fixture checks (for regression runs)')
+    parser.add_argument('--update-expected', action='store_true', help='record the current card output as fixtures/expected')
+    arguments = parser.parse_args()
+    if not arguments.fixtures_only and not arguments.update_expected:
+        benchmark_speech_writes()
+        benchmark_parsing()
+        benchmark_chunking()
+        benchmark_http_fetch()
+        benchmark_flashcard_writer()
+    benchmark_fixture_stages()
+    if not benchmark_fixture_pipeline(arguments.update_expected):
+        sys.exit(1)
@@ -1,124 +1,1126 @@
 import re
 import time
 import random
+import json
+import shutil
+import sqlite3
+import hashlib
+import queue
+import collections
+import io
+import csv
+import cProfile
+import contextlib
+import bisect
+import sys
+import wave
+import subprocess
 import os.path
+import urllib3
+import threading
+import urllib.parse
+from html.parser import HTMLParser
+from xml.sax.saxutils import escape
 import selenium.webdriver
-from openai import OpenAI
+from openai import OpenAI, RateLimitError
+from concurrent.futures import ThreadPoolExecutor, Future
 import undetected_chromedriver
 from selenium.webdriver.common.by import By
 import azure.cognitiveservices.speech as speechsdk
 from selenium.webdriver.support.wait import WebDriverWait
 from selenium.webdriver.support import expected_conditions as Ec
-from selenium.common import NoSuchElementException, StaleElementReferenceException, TimeoutException
+from selenium.common import StaleElementReferenceException, TimeoutException
 
 
 browser: selenium.webdriver.Chrome | None = None
 
 
-def wait_for_element(driver: undetected_chromedriver.Chrome, timeout: float, selector_type: str, selector_text: str):
-    return WebDriverWait(driver, timeout).until(Ec.element_to_be_clickable((selector_type, selector_text)))
+WAIT_TIMEOUT = 30
+WAIT_POLL_INTERVAL = 0.1
+DOM_QUIET_MS = 300
+
+
+class WaitTelemetry(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.waits = {}
+
+    def reset(self):
+        with self.lock:
+            self.waits = {}
+
+    def record(self, name, seconds, timed_out=False):
+        with self.lock:
+            count, total, longest, timeouts = self.waits.get(name, (0, 0.0, 0.0, 0))
+            self.waits[name] = (count + 1, total + seconds, max(longest, seconds), timeouts + (1 if timed_out else 0))
+
+    def summary(self, top=10):
+        waits = sorted(self.waits.items(), key=lambda item: item[1][1], reverse=True)[:top]
+        return 'Waits: ' + ', '.join(f'{name} {count}x {total:.1f}s (max {longest:.1f}s{f", {timeouts} timeouts" if timeouts else ""})' for name, (count, total, longest, timeouts) in waits)
+
+
+WAIT_TELEMETRY = WaitTelemetry()
+
+
+class RunMetrics(object):
+    # Timers and counters for every stage of a run (page loads, WebDriver scripts, parsing, TTS requests, file writes),
+    # written out as JSON or CSV at the end of run() so a slow run shows where its time went
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.started = time.perf_counter()
+            self.stages, self.counters, self.speech = {}, {}, {}
+
+    @contextlib.contextmanager
+    def timer(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - start)
+
+    def record(self, stage, seconds):
+        with self.lock:
+            count, total, longest = self.stages.get(stage, (0, 0.0, 0.0))
+            self.stages[stage] = (count + 1, total + seconds, max(longest, seconds))
+
+    def count(self, counter, amount=1):
+        with self.lock:
+            self.counters[counter] = self.counters.get(counter, 0) + amount
+
+    def record_speech(self, provider, characters, price_per_million_chars=0.0, requests=1):
+        with self.lock:
+            total_requests, total_characters, _ = self.speech.get(provider, (0, 0, 0.0))
+            self.speech[provider] = (total_requests + requests, total_characters + characters, price_per_million_chars)
+
+    def report(self):
+        with self.lock:
+            return {
+                'seconds': time.perf_counter() - self.started,
+                'stages': {stage: {'count': count, 'seconds': total, 'max_seconds': longest} for stage, (count, total, longest) in self.stages.items()},
+                'waits': {name: {'count': count, 'seconds': total, 'max_seconds': longest, 'timeouts': timeouts} for name, (count, total, longest, timeouts) in WAIT_TELEMETRY.waits.items()},
+                'counters': dict(self.counters),
+                'tts': {provider: {'requests': requests, 'characters': characters, 'estimated_cost_usd': characters * price / 1000000} for provider, (requests, characters, price) in self.speech.items()}
+            }
+
+    def save(self, file):
+        # A .csv file gets one row per stage, wait, counter and provider, anything else is written as JSON
+        report = self.report()
+        with open(file=f'{file}.part', mode='w', encoding='utf-8', newline='') as metrics_file:
+            if file.endswith('.csv'):
+                writer = csv.writer(metrics_file)
+                writer.writerow(['section', 'name', 'count', 'seconds', 'max_seconds', 'characters', 'estimated_cost_usd'])
+                writer.writerow(['run', 'total', '', f'{report["seconds"]:.3f}', '', '', ''])
+                for section in ['stages', 'waits']:
+                    for name, stage in report[section].items():
+                        writer.writerow([section, name, stage['count'], f'{stage["seconds"]:.3f}', f'{stage["max_seconds"]:.3f}', '', ''])
+                for name, count in report['counters'].items():
+                    writer.writerow(['counters', name, count, '', '', '', ''])
+                for provider, speech in report['tts'].items():
+                    writer.writerow(['tts', provider, speech['requests'], '', '', speech['characters'], f'{speech["estimated_cost_usd"]:.4f}'])
+            else:
+                json.dump(report, metrics_file, indent=2)
+        os.replace(f'{file}.part', file)
+
+    def summary(self, top=8):
+        report = self.report()
+        stages = sorted(report['stages'].items(), key=lambda item: item[1]['seconds'], reverse=True)[:top]
+        summary = f'Run: {report["seconds"]:.1f}s, ' + ', '.join(f'{stage} {values["count"]}x {values["seconds"]:.1f}s' for stage, values in stages)
+        for provider, speech in report['tts'].items():
+            summary += f'\nTTS {provider}: {speech["requests"]} requests, {speech["characters"]} characters, about ${speech["estimated_cost_usd"]:.2f}'
+        return summary
+
+
+RUN_METRICS = RunMetrics()
+
+
+def configure_waits(timeout=30, poll_interval=0.1, dom_quiet_ms=300):
+    global WAIT_TIMEOUT, WAIT_POLL_INTERVAL, DOM_QUIET_MS
+    WAIT_TIMEOUT, WAIT_POLL_INTERVAL, DOM_QUIET_MS = timeout, poll_interval, dom_quiet_ms
+
+
+def wait_until(driver, timeout: float, name: str, condition, poll_frequency: float = None):
+    start = time.perf_counter()
+    try:
+        result = WebDriverWait(driver, timeout, poll_frequency=poll_frequency or WAIT_POLL_INTERVAL).until(condition)
+    except TimeoutException:
+        WAIT_TELEMETRY.record(name, time.perf_counter() - start, timed_out=True)
+        raise
+    WAIT_TELEMETRY.record(name, time.perf_counter() - start)
+    return result
+
+
+def wait_for_element(driver: undetected_chromedriver.Chrome, timeout: float, selector_type: str, selector_text: str, poll_frequency: float = None):
+    return wait_until(driver, timeout, selector_text, Ec.element_to_be_clickable((selector_type, selector_text)), poll_frequency)
+
+
+# Resolves once the document has loaded and neither the DOM nor the list of fetched resources changed for quietMs
+WAIT_FOR_DOM_QUIET_JS = """
+const waitForDomQuiet = (quietMs, timeoutMs, done) => {
+    const started = Date.now();
+    let lastChange = started;
+    let resources = performance.getEntriesByType('resource').length;
+    const observer = new MutationObserver(() => { lastChange = Date.now(); });
+    observer.observe(document, {childList: true, subtree: true, attributes: true, characterData: true});
+    const check = () => {
+        const now = Date.now();
+        const currentResources = performance.getEntriesByType('resource').length;
+        if (currentResources !== resources) { resources = currentResources; lastChange = now; }
+        if ((document.readyState === 'complete' && now - lastChange >= quietMs) || now - started >= timeoutMs) {
+            observer.disconnect();
+            done(now - started);
+        } else {
+            setTimeout(check, 50);
+        }
+    };
+    check();
+};
+"""
+PAGE_READY_SCRIPT = WAIT_FOR_DOM_QUIET_JS + """
+waitForDomQuiet(arguments[0], arguments[1], arguments[arguments.length - 1]);
+"""
+
+
+def wait_for_page_ready(driver: undetected_chromedriver.Chrome, name='page ready'):
+    start = time.perf_counter()
+    # Stays below the driver's 30s default script timeout, a page that never settles just stops being waited on
+    driver.execute_async_script(PAGE_READY_SCRIPT, DOM_QUIET_MS, min(WAIT_TIMEOUT, 25) * 1000)
+    WAIT_TELEMETRY.record(name, time.perf_counter() - start)
+
+
+def open_page(driver, url):
+    with RUN_METRICS.timer('page load'):
+        driver.get(url)
+
+
+def run_script(driver, name, script, *args):
+    with RUN_METRICS.timer(f'{name} script'):
+        return driver.execute_script(script, *args)
+
+
+# Default request budgets, tts-1 allows 50 RPM on the lowest OpenAI tier and Azure S0 allows 200 TPS
+TTS_REQUESTS_PER_MINUTE = {'OpenAI': 50, 'Azure': 200 * 60}
+
+
+class RateLimiter(object):
+    def __init__(self, requests_per_minute):
+        self.interval = 60 / requests_per_minute if requests_per_minute else 0
+        self.next_slot = 0.0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot)
+            self.next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+    def back_off(self, seconds):
+        with self.lock:
+            self.next_slot = max(self.next_slot, time.monotonic() + seconds)
+
+
+def is_rate_limit_error(error: Exception):
+    return isinstance(error, RateLimitError) or '429' in str(error) or 'TooManyRequests' in str(error)
+
+
+def retry_after_seconds(error: Exception):
+    try:
+        return float(error.response.headers['retry-after'])
+    except (AttributeError, KeyError, TypeError, ValueError):
+        return None
+
+
+class CircuitBreaker(object):
+    # Opens after failure_threshold calls in a row gave up, then fails every call straight away until the cooldown is
+    # over. The first call after that is let through as a probe, its success closes the breaker and a failure reopens it.
+    def __init__(self, name, failure_threshold=3, cooldown=120.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self.times_opened = 0
+        self.lock = threading.Lock()
+
+    def check(self):
+        with self.lock:
+            if self.opened_at is None:
+                return
+            remaining = self.opened_at + self.cooldown - time.monotonic()
+            if remaining > 0:
+                raise Exception(f'{self.name} failed {self.failures} times in a row, not trying it again for {remaining:.0f}s.')
+            # Half open, one more failure reopens it for another cooldown
+            self.opened_at = None
+            self.failures = self.failure_threshold - 1
+
+    def record(self, succeeded):
+        with self.lock:
+            if succeeded:
+                self.failures = 0
+                return
+            self.failures += 1
+            if self.failures >= self.failure_threshold and self.opened_at is None:
+                self.opened_at = time.monotonic()
+                self.times_opened += 1
+                print(f'{self.name} keeps failing, pausing calls to it for {self.cooldown:.0f}s.')
+
+
+class RetryPolicy(object):
+    # Retries a call with an exponential backoff plus jitter (or the server's Retry-After) and keeps a circuit breaker
+    # per host or provider, so a service that is down fails fast instead of every caller sitting out its own backoff
+    def __init__(self, max_attempts=5, base_delay=1.0, max_delay=60.0, jitter=1.0, failure_threshold=3, cooldown=120.0):
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.breakers = {}
+        self.lock = threading.Lock()
+
+    def breaker(self, key):
+        with self.lock:
+            if key not in self.breakers:
+                self.breakers[key] = CircuitBreaker(key, self.failure_threshold, self.cooldown)
+            return self.breakers[key]
+
+    def delay(self, attempt, error=None):
+        return retry_after_seconds(error) or min(self.max_delay, self.base_delay * 2.0 ** attempt) + random.uniform(0, self.jitter)
+
+    def run(self, key, function, description, on_retry=None):
+        # on_retry(error, delay) is called before each backoff. Rate limit errors don't count against the breaker,
+        # they mean the service is up but busy.
+        breaker = self.breaker(key)
+        for attempt in range(1, self.max_attempts + 1):
+            breaker.check()
+            try:
+                result = function()
+            except Exception as e:
+                if attempt == self.max_attempts:
+                    if not is_rate_limit_error(e):
+                        breaker.record(False)
+                    raise
+                delay = self.delay(attempt, e)
+                if on_retry is not None:
+                    on_retry(e, delay)
+                print(f'{description} failed (attempt {attempt} of {self.max_attempts}), retrying in {delay:.1f}s.', e)
+                time.sleep(delay)
+            else:
+                breaker.record(True)
+                return result
+
+    def summary(self):
+        opened = [f'{breaker.name} {breaker.times_opened}x' for breaker in self.breakers.values() if breaker.times_opened]
+        return f'Circuit breakers opened: {", ".join(opened)}' if opened else ''
+
+
+AUDIO_CHUNK_SIZE = 64 * 1024
+OPENAI_VOICES = ['alloy', 'echo', 'fable', 'onyx', 'nova', 'shimmer']
+AZURE_VOICES = [
+    'en-AU-NatashaNeural',
+    'en-AU-WilliamNeural',
+    'en-AU-AnnetteNeural',
+    'en-AU-CarlyNeural',
+    'en-AU-DarrenNeural',
+    'en-AU-DuncanNeural',
+    'en-AU-ElsieNeural',
+    'en-AU-FreyaNeural',
+    'en-AU-JoanneNeural',
+    'en-AU-KenNeural',
+    'en-AU-KimNeural',
+    'en-AU-NeilNeural',
+    'en-AU-TimNeural',
+    'en-AU-TinaNeural',
+    'en-CA-ClaraNeural',
+    'en-CA-LiamNeural',
+    'en-GB-SoniaNeural',
+    'en-GB-RyanNeural',
+    'en-GB-LibbyNeural',
+    'en-GB-AbbiNeural',
+    'en-GB-AlfieNeural',
+    'en-GB-BellaNeural',
+    'en-GB-ElliotNeural',
+    'en-GB-EthanNeural',
+    'en-GB-HollieNeural',
+    'en-GB-NoahNeural',
+    'en-GB-OliverNeural',
+    'en-GB-OliviaNeural',
+    'en-GB-ThomasNeural',
+    'en-IE-EmilyNeural',
+    'en-IE-ConnorNeural',
+    'en-US-JennyMultilingualNeural',
+    'en-US-JennyNeural',
+    'en-US-GuyNeural',
+    'en-US-AriaNeural',
+    'en-US-DavisNeural',
+    'en-US-AmberNeural',
+    'en-US-AndrewNeural',
+    'en-US-AshleyNeural',
+    'en-US-BrandonNeural',
+    'en-US-BrianNeural',
+    'en-US-ChristopherNeural',
+    'en-US-CoraNeural',
+    'en-US-ElizabethNeural',
+    'en-US-EmmaNeural',
+    'en-US-EricNeural',
+    'en-US-JacobNeural',
+    'en-US-JaneNeural',
+    'en-US-JasonNeural',
+    'en-US-MichelleNeural',
+    'en-US-MonicaNeural',
+    'en-US-NancyNeural',
+    'en-US-RogerNeural',
+    'en-US-SaraNeural',
+    'en-US-SteffanNeural',
+    'en-US-TonyNeural',
+    'en-ZA-LeahNeural',
+    'en-ZA-LukeNeural'
+]
+
+
+# MIME type for the <audio> tag of every selectable output format, an empty audio_format keeps the original .wav files
+AUDIO_FORMATS = {'mp3': 'audio/mpeg', 'opus': 'audio/ogg', 'ogg': 'audio/ogg', 'wav': 'audio/wav'}
+FFMPEG_CODECS = {'mp3': ['-c:a', 'libmp3lame', '-f', 'mp3'], 'opus': ['-c:a', 'libopus', '-f', 'ogg'], 'ogg': ['-c:a', 'libvorbis', '-f', 'ogg'], 'wav': ['-c:a', 'pcm_s16le', '-f', 'wav']}
+# Formats Azure can produce itself, keyed on (format, sample rate, kbps), 0 kbps meaning the format has no bitrate setting
+AZURE_OUTPUT_FORMATS = {
+    ('mp3', 16000, 32): 'Audio16Khz32KBitRateMonoMp3',
+    ('mp3', 16000, 64): 'Audio16Khz64KBitRateMonoMp3',
+    ('mp3', 16000, 128): 'Audio16Khz128KBitRateMonoMp3',
+    ('mp3', 24000, 48): 'Audio24Khz48KBitRateMonoMp3',
+    ('mp3', 24000, 96): 'Audio24Khz96KBitRateMonoMp3',
+    ('mp3', 24000, 160): 'Audio24Khz160KBitRateMonoMp3',
+    ('mp3', 48000, 96): 'Audio48Khz96KBitRateMonoMp3',
+    ('mp3', 48000, 192): 'Audio48Khz192KBitRateMonoMp3',
+    ('opus', 16000, 0): 'Ogg16Khz16BitMonoOpus',
+    ('opus', 24000, 0): 'Ogg24Khz16BitMonoOpus',
+    ('opus', 48000, 0): 'Ogg48Khz16BitMonoOpus',
+    ('wav', 16000, 0): 'Riff16Khz16BitMonoPcm',
+    ('wav', 22050, 0): 'Riff22050Hz16BitMonoPcm',
+    ('wav', 24000, 0): 'Riff24Khz16BitMonoPcm',
+    ('wav', 44100, 0): 'Riff44100Hz16BitMonoPcm',
+    ('wav', 48000, 0): 'Riff48Khz16BitMonoPcm'
+}
+AZURE_PCM_FORMATS = {8000: 'Raw8Khz16BitMonoPcm', 16000: 'Raw16Khz16BitMonoPcm', 22050: 'Raw22050Hz16BitMonoPcm', 24000: 'Raw24Khz16BitMonoPcm', 44100: 'Raw44100Hz16BitMonoPcm', 48000: 'Raw48Khz16BitMonoPcm'}
+# What the audio would have taken as the original 24 kHz 16-bit WAV, the baseline for the bytes saved report
+WAV_BYTES_PER_SECOND = 24000 * 2
+# A partly filled SSML batch is sent once its oldest card waited this long, so short cards don't hold up the CSV
+SSML_BATCH_WAIT = 2.0
+SSML_TEMPLATE = "<speak version='1.0' xmlns='http://www.w3.org/2001/10/synthesis' xml:lang='en-US'>{}</speak>"
+
+
+def id3_tag_length(header: bytes):
+    if len(header) < 10 or not header.startswith(b'ID3'):
+        return 0
+    return 10 + (header[6] << 21 | header[7] << 14 | header[8] << 7 | header[9]) + (10 if header[5] & 0x10 else 0)
+
+
+class AudioFileWriter(object):
+    # Streams audio segments into a temporary file that only replaces the target once every segment arrived.
+    # MP3 frames can be concatenated as is, so the only thing stripped from later segments is their ID3 tag.
+    def __init__(self, file):
+        self.file = file
+        self.temp_file = f'{file}.part'
+        self.handle = None
+        self.segments = 0
+        self.bytes_written = 0
+
+    def __enter__(self):
+        self.handle = open(file=self.temp_file, mode='wb')
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.handle.close()
+        if exc_type is None:
+            os.replace(self.temp_file, self.file)
+        elif os.path.isfile(self.temp_file):
+            os.remove(self.temp_file)
+        return False
+
+    def write_segment(self, chunks):
+        pending, skip = b'', None if self.segments else 0
+        for chunk in chunks:
+            if skip is None:
+                pending += chunk
+                if len(pending) < 10:
+                    continue
+                chunk, pending, skip = pending, b'', id3_tag_length(pending)
+            if skip:
+                dropped = min(skip, len(chunk))
+                chunk, skip = chunk[dropped:], skip - dropped
+            self.write(chunk)
+        self.write(pending)
+        self.segments += 1
+
+    def write(self, data: bytes):
+        if data:
+            self.handle.write(data)
+            self.bytes_written += len(data)
+
+
+class PcmEncoder(object):
+    # Encodes 16-bit mono PCM as it streams in. WAV at the source rate is written directly, anything else is piped
+    # through ffmpeg. Like AudioFileWriter, the target is only replaced once the whole clip was encoded.
+    def __init__(self, file, audio_format, input_rate=24000, sample_rate=0, bitrate=0):
+        self.file = file
+        self.temp_file = f'{file}.part'
+        self.audio_format = audio_format
+        self.input_rate = input_rate
+        self.sample_rate = sample_rate
+        self.bitrate = bitrate
+        self.process = None
+        self.wav = None
+        self.pcm_bytes = 0
+
+    @staticmethod
+    def needs_ffmpeg(audio_format, input_rate, sample_rate):
+        return audio_format != 'wav' or sample_rate not in (0, input_rate)
+
+    def __enter__(self):
+        if self.needs_ffmpeg(self.audio_format, self.input_rate, self.sample_rate):
+            command = ['ffmpeg', '-hide_banner', '-loglevel', 'error', '-y', '-f', 's16le', '-ar', str(self.input_rate), '-ac', '1', '-i', 'pipe:0']
+            if self.sample_rate:
+                command += ['-ar', str(self.sample_rate)]
+            if self.bitrate:
+                command += ['-b:a', f'{self.bitrate}k']
+            self.process = subprocess.Popen(command + FFMPEG_CODECS[self.audio_format] + [self.temp_file], stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+        else:
+            self.wav = wave.open(self.temp_file, 'wb')
+            self.wav.setnchannels(1)
+            self.wav.setsampwidth(2)
+            self.wav.setframerate(self.input_rate)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        error = None
+        if self.process is not None:
+            self.process.stdin.close()
+            output = self.process.stderr.read()
+            if self.process.wait() != 0:
+                error = f'ffmpeg could not encode {self.file}: {output.decode("utf-8", errors="replace").strip()}'
+        else:
+            self.wav.close()
+        if exc_type is None and error is None:
+            os.replace(self.temp_file, self.file)
+        elif os.path.isfile(self.temp_file):
+            os.remove(self.temp_file)
+        if exc_type is None and error is not None:
+            raise Exception(error)
+        return False
+
+    def write_segment(self, chunks):
+        for chunk in chunks:
+            self.write(chunk)
+
+    def write(self, data: bytes):
+        if not data:
+            return
+        if self.process is not None:
+            self.process.stdin.write(data)
+        else:
+            self.wav.writeframesraw(data)
+        self.pcm_bytes += len(data)
+
+    @property
+    def seconds(self):
+        return self.pcm_bytes / (self.input_rate * 2)
+
+
+# Where a chunk may end, best first: after a sentence, after a clause (or line), after a word
+CHUNK_BOUNDARY_PATTERNS = [
+    re.compile(r'[.!?]+["\')\]]*(?=\s)'),
+    re.compile(r'[,;:](?=\s)|\n'),
+    re.compile(r'\s')
+]
+
+
+def chunk_text(text, max_chars=None):
+    # Splits text for backends with a request size limit. Every boundary is found in one pass up front, then each
+    # chunk ends at the last sentence that fits its budget, else the last clause, else the last word, else mid-word.
+    text = text.strip()
+    if not max_chars or len(text) <= max_chars:
+        return [text]
+    boundaries = [[match.end() for match in pattern.finditer(text)] for pattern in CHUNK_BOUNDARY_PATTERNS]
+    text_chunks, start = [], 0
+    while len(text) - start > max_chars:
+        end = start + max_chars
+        for positions in boundaries:
+            index = bisect.bisect_right(positions, end) - 1
+            if index >= 0 and positions[index] > start:
+                end = positions[index]
+                break
+        text_chunks.append(text[start:end].strip())
+        start = end
+        while start < len(text) and text[start].isspace():
+            start += 1
+    text_chunks.append(text[start:].strip())
+    return [chunk for chunk in text_chunks if chunk]
+
+
+class TtsBackend(object):
+    # A speech provider. Speaker takes care of rate limits, retries, output formats and stats, a backend only turns
+    # text into audio and describes what it can do:
+    #   max_chars            longest text per request (None for no limit), longer cards are split by chunk_text and
+    #                        their chunks are synthesized concurrently
+    #   pcm_rate             rate of the 16-bit mono PCM it produces when a format isn't native to it
+    #   legacy_extension     container of its audio before audio_format existed, kept for cache keys and paths
+    #   supports_batch       synthesize_batch covers several short cards with one request
+    #   requests_per_minute  default request budget, 0 for no limit
+    #   price_per_million_chars  USD list price, only used for the cost estimate in the run metrics
+    name = ''
+    voices = []
+    max_chars = None
+    pcm_rate = 24000
+    legacy_extension = 'wav'
+    supports_batch = False
+    requests_per_minute = 0
+    price_per_million_chars = 0.0
+
+    def __init__(self, speaker, **kwargs):
+        self.speaker = speaker
+
+    def native_format(self, output_format, sample_rate, bitrate):
+        # The backend's own name for the requested output, or None when it has to be encoded from PCM
+        return None
+
+    def concatenable(self, native_format):
+        # Whether clips in this native format can be joined byte for byte, otherwise multi chunk cards are made from PCM
+        return False
+
+    def synthesize_chunk(self, text, voice, native):
+        # Returns the audio of one chunk as an iterable of bytes, in speaker.native_format when native is True and
+        # as 16-bit mono PCM at pcm_rate otherwise, together with its duration in seconds (None if unknown)
+        raise NotImplementedError
+
+    def synthesize_batch(self, items):
+        # items are (file, text, voice), returns the duration of every clip
+        raise NotImplementedError
+
+
+class OpenAIBackend(TtsBackend):
+    name = 'OpenAI'
+    voices = OPENAI_VOICES
+    max_chars = 4096
+    legacy_extension = 'mp3'
+    requests_per_minute = TTS_REQUESTS_PER_MINUTE['OpenAI']
+    # tts-1
+    price_per_million_chars = 15.0
+
+    def __init__(self, speaker, **kwargs):
+        super().__init__(speaker)
+        self.client = OpenAI(api_key=kwargs['open_ai_key'])
+
+    def native_format(self, output_format, sample_rate, bitrate):
+        if not output_format:
+            return 'mp3'
+        # Several requests per clip are concatenated, which MP3 frames and chained Ogg streams survive but WAV headers do not
+        return output_format if output_format in ['mp3', 'opus'] and not bitrate and not sample_rate else None
+
+    def concatenable(self, native_format):
+        return native_format in ['mp3', 'opus']
+
+    def synthesize_chunk(self, text, voice, native):
+        return self.stream(text, voice, self.speaker.native_format if native else 'pcm'), None
+
+    def stream(self, text, voice, response_format):
+        with self.client.audio.speech.with_streaming_response.create(model="tts-1", voice=voice, input=text, response_format=response_format) as response:
+            yield from response.iter_bytes(AUDIO_CHUNK_SIZE)
+
+
+class AzureBackend(TtsBackend):
+    name = 'Azure'
+    voices = AZURE_VOICES
+    # A request may produce up to 10 minutes of audio, roughly 9000 characters
+    max_chars = 5000
+    supports_batch = True
+    requests_per_minute = TTS_REQUESTS_PER_MINUTE['Azure']
+    # Neural voices, pay as you go
+    price_per_million_chars = 15.0
+
+    def __init__(self, speaker, **kwargs):
+        super().__init__(speaker)
+        self.key = kwargs['azure_key']
+        self.region = kwargs['azure_region']
+        sample_rate = kwargs.get('audio_sample_rate') or 0
+        self.pcm_rate = sample_rate if sample_rate in AZURE_PCM_FORMATS else 24000
+        # Synthesizers are kept open and reused per output format, each worker borrows one at a time
+        self.lock = threading.Lock()
+        self.speech_configs, self.synthesizers = {}, {}
+
+    def native_format(self, output_format, sample_rate, bitrate):
+        if not output_format:
+            return 'Riff24Khz16BitMonoPcm'
+        return AZURE_OUTPUT_FORMATS.get((output_format, sample_rate or 24000, bitrate or (48 if output_format == 'mp3' else 0)))
+
+    def acquire_synthesizer(self, output_format):
+        with self.lock:
+            if output_format not in self.synthesizers:
+                speech_config = speechsdk.speech.SpeechConfig(subscription=self.key, region=self.region)
+                speech_config.set_speech_synthesis_output_format(getattr(speechsdk.SpeechSynthesisOutputFormat, output_format))
+                self.speech_configs[output_format] = speech_config
+                self.synthesizers[output_format] = queue.LifoQueue()
+        try:
+            return self.synthesizers[output_format].get_nowait()
+        except queue.Empty:
+            return speechsdk.SpeechSynthesizer(speech_config=self.speech_configs[output_format], audio_config=None)
+
+    def release_synthesizer(self, output_format, synthesizer):
+        self.synthesizers[output_format].put(synthesizer)
+
+    def synthesize_ssml(self, output_format, ssml, on_bookmark=None):
+        synthesizer = self.acquire_synthesizer(output_format)
+        if on_bookmark is not None:
+            synthesizer.bookmark_reached.connect(on_bookmark)
+        try:
+            result = synthesizer.speak_ssml_async(ssml).get()
+        finally:
+            if on_bookmark is not None:
+                synthesizer.bookmark_reached.disconnect_all()
+        # A synthesizer whose request failed is dropped, its connection may be the reason
+        if result.reason != speechsdk.ResultReason.SynthesizingAudioCompleted:
+            raise Exception(f"Speech synthesis failed. Reason: {result.reason}, Details: {result.cancellation_details.error_details}")
+        self.release_synthesizer(output_format, synthesizer)
+        return result
+
+    def concatenable(self, native_format):
+        return native_format.endswith('Mp3') or native_format.startswith('Ogg')
+
+    def synthesize_chunk(self, text, voice, native):
+        # The voice is picked in the SSML, so one pooled synthesizer per format serves every voice
+        result = self.synthesize_ssml(self.speaker.native_format if native else AZURE_PCM_FORMATS[self.pcm_rate], SSML_TEMPLATE.format(f'<voice name="{voice}">{escape(text)}</voice>'))
+        return [result.audio_data], result.audio_duration.total_seconds()
+
+    def synthesize_batch(self, items):
+        # One SSML request with a bookmark before every card, the PCM is split at the bookmarks' audio offsets
+        ssml = SSML_TEMPLATE.format(''.join(f'<voice name="{voice}"><bookmark mark="{index}"/>{escape(text)}</voice>' for index, (_, text, voice) in enumerate(items)))
+        offsets = {}
+
+        def on_bookmark(event):
+            offsets[int(event.text)] = event.audio_offset
+
+        result = self.synthesize_ssml(AZURE_PCM_FORMATS[self.pcm_rate], ssml, on_bookmark)
+        if len(offsets) != len(items):
+            raise Exception(f'Only {len(offsets)} of {len(items)} bookmarks were reached.')
+        audio = result.audio_data
+        # Bookmark offsets are in 100 ns ticks, each sample is two bytes
+        bounds = [min(len(audio), round(offsets[index] * self.pcm_rate / 10 ** 7) * 2) for index in range(len(items))] + [len(audio)]
+        durations = []
+        for index, (file, _, _) in enumerate(items):
+            with self.speaker.open_pcm_writer(file) as writer:
+                writer.write(audio[bounds[index]:bounds[index + 1]])
+            durations.append(writer.seconds)
+        return durations
+
+
+class LocalBackend(TtsBackend):
+    # Runs espeak-ng or piper on this machine, one process per card, so tts_workers cards are synthesized in parallel
+    # without any quota. piper_model is the path of a piper voice (.onnx, with its .onnx.json next to it).
+    name = 'Local'
+    voices = ['en-us', 'en-gb', 'en-gb-x-rp', 'en-gb-scotland', 'en-029']
+    # Not a limit of the engines, long cards are cut up so their chunks run in parallel processes
+    max_chars = 1000
+    legacy_extension = 'wav'
+
+    def __init__(self, speaker, **kwargs):
+        super().__init__(speaker)
+        self.engine = kwargs.get('local_engine') or 'espeak-ng'
+        self.model = kwargs.get('piper_model') or ''
+        if self.engine not in ['espeak-ng', 'piper']:
+            raise Exception(f'Unknown local TTS engine {self.engine}, please pick espeak-ng or piper.')
+        if shutil.which(self.engine) is None:
+            raise Exception(f'{self.engine} was not found, please install it or pick another tts_service.')
+        if self.engine == 'piper':
+            if not self.model:
+                raise Exception('piper needs piper_model, the path of a voice .onnx file.')
+            with open(file=f'{self.model}.json', mode='r', encoding='utf-8') as file:
+                self.pcm_rate = json.load(file)['audio']['sample_rate']
+            self.voices = [os.path.basename(self.model)]
+        else:
+            self.pcm_rate = 22050
+
+    def synthesize_chunk(self, text, voice, native):
+        if self.engine == 'piper':
+            command = ['piper', '--model', self.model, '--output-raw']
+        else:
+            command = ['espeak-ng', '-v', voice, '--stdout', '--stdin']
+        result = subprocess.run(command, input=text.encode('utf-8'), capture_output=True)
+        if result.returncode != 0:
+            raise Exception(f'{self.engine} failed: {result.stderr.decode("utf-8", errors="replace").strip()}')
+        audio = result.stdout
+        if self.engine == 'espeak-ng':
+            with wave.open(io.BytesIO(audio)) as wav:
+                audio = wav.readframes(wav.getnframes())
+        return [audio], len(audio) / (self.pcm_rate * 2)
+
+
+class FakeBackend(TtsBackend):
+    # Deterministic offline stand-in for tests and benchmarks. Every character becomes 10 ms of a tone picked from the
+    # text's hash, after fake_latency seconds per request to stand in for the network.
+    name = 'Fake'
+    voices = ['fake-1', 'fake-2']
+    max_chars = 4096
+    supports_batch = True
+
+    def __init__(self, speaker, **kwargs):
+        super().__init__(speaker)
+        self.latency = kwargs.get('fake_latency') or 0.0
+        self.lock = threading.Lock()
+        self.requests = 0
+
+    def request(self):
+        with self.lock:
+            self.requests += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def pcm(self, text):
+        tone = hashlib.sha256(text.encode('utf-8')).digest()[:2]
+        return tone * (len(text) * self.pcm_rate // 100)
+
+    def synthesize_chunk(self, text, voice, native):
+        self.request()
+        audio = self.pcm(text)
+        return [audio], len(audio) / (self.pcm_rate * 2)
+
+    def synthesize_batch(self, items):
+        self.request()
+        durations = []
+        for file, text, _ in items:
+            with self.speaker.open_pcm_writer(file) as writer:
+                writer.write(self.pcm(text))
+            durations.append(writer.seconds)
+        return durations
+
+
+TTS_BACKENDS = {}
+
+
+def register_tts_backend(backend):
+    # Makes a TtsBackend subclass available as tts_service=backend.name. A missing method is caught here rather than
+    # on the first card that needs it.
+    if backend.synthesize_chunk is TtsBackend.synthesize_chunk:
+        raise Exception(f'TTS backend {backend.name} has to implement synthesize_chunk.')
+    if backend.supports_batch and backend.synthesize_batch is TtsBackend.synthesize_batch:
+        raise Exception(f'TTS backend {backend.name} sets supports_batch but does not implement synthesize_batch.')
+    TTS_BACKENDS[backend.name] = backend
+
+
+for backend in [OpenAIBackend, AzureBackend, LocalBackend, FakeBackend]:
+    register_tts_backend(backend)
 
 
 class Speaker(object):
     def __init__(self, service, **kwargs):
+        if service not in TTS_BACKENDS:
+            raise Exception(f'Unknown TTS service {service}, please pick one of {", ".join(TTS_BACKENDS)}.')
         self.service = service
-        if self.service == 'OpenAI':
-            self.client = OpenAI(api_key=kwargs['open_ai_key'])
-        else:
-            self.key = kwargs['azure_key']
-            self.region = kwargs['azure_region']
-
-    def generate_speech(self, file, text):
-        if self.service == 'OpenAI':
-            voices = ['alloy', 'echo', 'fable', 'onyx', 'nova', 'shimmer']
-            voice = voices[random.randint(0, len(voices) - 1)]
-            text_chunks = []
-            while len(text) > 4096:
-                last_full_stop_index = text.rfind('.', 0, 4096)
-                if last_full_stop_index == -1:
-                    last_full_stop_index = 4096
-                text_chunks.append(text[:last_full_stop_index + 1])
-                text = text[last_full_stop_index + 1:].strip()
-            text_chunks.append(text)
-            audio = bytes()
-            for chunk in text_chunks:
-                response = self.client.audio.speech.create(model="tts-1", voice=voice, input=chunk)
-                for byte in response.iter_bytes():
-                    audio = audio + byte
-            with open(file=file, mode='wb') as file:
-                file.write(audio)
-        else:
-            voices = [
-                'en-AU-NatashaNeural',
-                'en-AU-WilliamNeural',
-                'en-AU-AnnetteNeural',
-                'en-AU-CarlyNeural',
-                'en-AU-DarrenNeural',
-                'en-AU-DuncanNeural',
-                'en-AU-ElsieNeural',
-                'en-AU-FreyaNeural',
-                'en-AU-JoanneNeural',
-                'en-AU-KenNeural',
-                'en-AU-KimNeural',
-                'en-AU-NeilNeural',
-                'en-AU-TimNeural',
-                'en-AU-TinaNeural',
-                'en-CA-ClaraNeural',
-                'en-CA-LiamNeural',
-                'en-GB-SoniaNeural',
-                'en-GB-RyanNeural',
-                'en-GB-LibbyNeural',
-                'en-GB-AbbiNeural',
-                'en-GB-AlfieNeural',
-                'en-GB-BellaNeural',
-                'en-GB-ElliotNeural',
-                'en-GB-EthanNeural',
-                'en-GB-HollieNeural',
-                'en-GB-NoahNeural',
-                'en-GB-OliverNeural',
-                'en-GB-OliviaNeural',
-                'en-GB-ThomasNeural',
-                'en-IE-EmilyNeural',
-                'en-IE-ConnorNeural',
-                'en-US-JennyMultilingualNeural',
-                'en-US-JennyNeural',
-                'en-US-GuyNeural',
-                'en-US-AriaNeural',
-                'en-US-DavisNeural',
-                'en-US-AmberNeural',
-                'en-US-AndrewNeural',
-                'en-US-AshleyNeural',
-                'en-US-BrandonNeural',
-                'en-US-BrianNeural',
-                'en-US-ChristopherNeural',
-                'en-US-CoraNeural',
-                'en-US-ElizabethNeural',
-                'en-US-EmmaNeural',
-                'en-US-EricNeural',
-                'en-US-JacobNeural',
-                'en-US-JaneNeural',
-                'en-US-JasonNeural',
-                'en-US-MichelleNeural',
-                'en-US-MonicaNeural',
-                'en-US-NancyNeural',
-                'en-US-RogerNeural',
-                'en-US-SaraNeural',
-                'en-US-SteffanNeural',
-                'en-US-TonyNeural',
-                'en-ZA-LeahNeural',
-                'en-ZA-LukeNeural'
-            ]
-            voice = voices[random.randint(0, len(voices)-1)]
-            speech_config = speechsdk.speech.SpeechConfig(subscription=self.key, region=self.region)
-            speech_config.speech_synthesis_voice_name = voice
-            speech_config.set_speech_synthesis_output_format(speechsdk.SpeechSynthesisOutputFormat.Riff24Khz16BitMonoPcm)
-            speech_synthesizer = speechsdk.SpeechSynthesizer(speech_config=speech_config, audio_config=None)
-            result = speech_synthesizer.speak_text_async(text).get()
-            if result.reason == speechsdk.ResultReason.SynthesizingAudioCompleted:
-                stream = speechsdk.AudioDataStream(result)
-                stream.save_to_wav_file(file)
-            else:
-                print(f"Speech synthesis failed. Reason: {result.reason}, Details: {result.cancellation_details.error_details}")
+        # An empty output_format keeps the original behaviour: OpenAI's MP3 and Azure's 24 kHz PCM, both saved as .wav
+        self.output_format = kwargs.get('audio_format') or ''
+        self.bitrate = kwargs.get('audio_bitrate') or 0
+        self.sample_rate = kwargs.get('audio_sample_rate') or 0
+        if self.output_format and self.output_format not in AUDIO_FORMATS:
+            raise Exception(f'Unknown audio format {self.output_format}, please pick one of {", ".join(AUDIO_FORMATS)}.')
+        self.backend = TTS_BACKENDS[service](self, **kwargs)
+        self.rate_limiter = RateLimiter(kwargs.get('requests_per_minute') or self.backend.requests_per_minute)
+        self.max_attempts = kwargs.get('max_attempts') or 5
+        self.retry_policy = RetryPolicy(self.max_attempts, failure_threshold=kwargs.get('circuit_breaker_failures') or 3, cooldown=kwargs.get('circuit_breaker_cooldown') or 120)
+        self.native_format = self.backend.native_format(self.output_format, self.sample_rate, self.bitrate)
+        self.pcm_rate = self.backend.pcm_rate
+        if self.native_format is None and PcmEncoder.needs_ffmpeg(self.output_format or 'wav', self.pcm_rate, self.sample_rate) and shutil.which('ffmpeg') is None:
+            raise Exception(f'{self.service} can not produce {self.output_format or "wav"} at these settings itself, please install ffmpeg to encode it locally.')
+        self.stats_lock = threading.Lock()
+        self.clips, self.bytes_written, self.measured_clips, self.measured_bytes, self.measured_seconds = 0, 0, 0, 0, 0.0
+        self.batch_size = kwargs.get('ssml_batch_size') or 0
+        self.batch_max_chars = kwargs.get('ssml_batch_max_chars') or 200
+        self.batches = 0
+        # Fetches the later chunks of a long card while its first chunk is being written
+        self.chunk_pool = ThreadPoolExecutor(max_workers=max(1, kwargs.get('chunk_workers') or 4))
+        self.chunked_clips = 0
+
+    @property
+    def audio_format(self):
+        # Part of the cache key, so clips in different formats or qualities never replace each other
+        if not self.output_format:
+            return self.backend.legacy_extension
+        return self.output_format + (f'-{self.sample_rate}hz' if self.sample_rate else '') + (f'-{self.bitrate}k' if self.bitrate else '')
+
+    @property
+    def extension(self):
+        return self.output_format or self.backend.legacy_extension
+
+    @property
+    def file_extension(self):
+        return self.output_format or 'wav'
+
+    @property
+    def mime_type(self):
+        return AUDIO_FORMATS[self.output_format] if self.output_format else 'audio/wav'
+
+    def open_writer(self, file, native):
+        # Native audio is written as it arrives, anything else is encoded from the backend's PCM
+        if native:
+            return AudioFileWriter(file)
+        return self.open_pcm_writer(file)
+
+    def open_pcm_writer(self, file):
+        return PcmEncoder(file, self.output_format or 'wav', self.pcm_rate, self.sample_rate, self.bitrate)
+
+    def can_batch(self, text):
+        # Batched audio is split as PCM, so the output must be WAV at the PCM rate or ffmpeg has to be there to encode it
+        if not self.backend.supports_batch or self.batch_size < 2 or len(text) > self.batch_max_chars:
+            return False
+        return not PcmEncoder.needs_ffmpeg(self.output_format or 'wav', self.pcm_rate, self.sample_rate) or shutil.which('ffmpeg') is not None
+
+    def speak_batch(self, items):
+        # items are (file, text, voice), one request covers all of them. If it fails they are retried one by one, so
+        # one bad card only loses its own audio. Returns the error of every item, None where it was synthesized.
+        self.rate_limiter.wait()
+        try:
+            with RUN_METRICS.timer('tts batch request'):
+                durations = self.backend.synthesize_batch(items)
+            self.record_characters(sum(len(text) for _, text, _ in items))
+        except Exception as e:
+            print(f'Batch of {len(items)} cards failed, synthesizing them one by one.', e)
+            errors = []
+            for file, text, voice in items:
+                try:
+                    self.speak(file, text, voice)
+                    errors.append(None)
+                except Exception as item_error:
+                    errors.append(item_error)
+            return errors
+        for (file, _, _), seconds in zip(items, durations):
+            self.record(file, seconds)
+        with self.stats_lock:
+            self.batches += 1
+        return [None] * len(items)
+
+    def record_characters(self, characters, requests=1):
+        RUN_METRICS.record_speech(self.service, characters, self.backend.price_per_million_chars, requests)
+
+    def record(self, file, seconds=None):
+        size = os.path.getsize(file)
+        with self.stats_lock:
+            self.clips += 1
+            self.bytes_written += size
+            if seconds is not None:
+                self.measured_clips += 1
+                self.measured_bytes += size
+                self.measured_seconds += seconds
+
+    def summary(self):
+        summary = f'Audio: {self.clips} clips, {self.bytes_written / 1024 / 1024:.1f} MB of {self.extension}'
+        if self.measured_clips:
+            saved = self.measured_seconds * WAV_BYTES_PER_SECOND - self.measured_bytes
+            summary += f', {saved / 1024 / 1024:.1f} MB saved against 24 kHz 16-bit WAV'
+            if self.measured_clips < self.clips:
+                summary += f' (measured on the {self.measured_clips} clips with a known duration)'
+        if self.batches:
+            summary += f', {self.batches} batched requests'
+        if self.chunked_clips:
+            summary += f', {self.chunked_clips} long clips synthesized in concurrent chunks'
+        if self.retry_policy.summary():
+            summary += f'\n{self.retry_policy.summary()}'
+        return summary
+
+    def voice_for(self, text):
+        # The voice still varies between cards, but the same text always gets the same voice so its audio can be cached
+        voices = self.backend.voices
+        return voices[int(hashlib.sha256(' '.join(text.split()).encode('utf-8')).hexdigest(), 16) % len(voices)]
+
+    def speak(self, file, text, voice=None):
+        def attempt():
+            self.rate_limiter.wait()
+            return self.generate_speech(file, text, voice)
+
+        return self.retry_policy.run(self.service, attempt, f'Speech synthesis for {file}', self.on_retry)
+
+    def on_retry(self, error, delay):
+        if is_rate_limit_error(error):
+            self.rate_limiter.back_off(delay)
+        RUN_METRICS.count('tts retries')
+
+    def generate_speech(self, file, text, voice=None):
+        voice = voice or self.voice_for(text)
+        text_chunks = chunk_text(text, self.backend.max_chars)
+        native = self.native_format is not None and (len(text_chunks) == 1 or self.backend.concatenable(self.native_format))
+        seconds = 0.0
+        # A clip's time includes streaming it to disk, the 'tts chunk' stage is only the prefetched later chunks
+        with RUN_METRICS.timer('tts clip'), self.open_writer(file, native) as writer:
+            for audio, chunk_seconds in self.synthesize_chunks(text_chunks, voice, native):
+                writer.write_segment(audio)
+                seconds = seconds + chunk_seconds if seconds is not None and chunk_seconds is not None else None
+        self.record_characters(sum(len(chunk) for chunk in text_chunks), len(text_chunks))
+        if len(text_chunks) > 1:
+            with self.stats_lock:
+                self.chunked_clips += 1
+        self.record(file, seconds if native else writer.seconds)
+
+    def synthesize_chunks(self, text_chunks, voice, native):
+        # The first chunk streams into the file while the others are fetched concurrently, they are written in order
+        later_chunks = [self.chunk_pool.submit(self.fetch_chunk, chunk, voice, native) for chunk in text_chunks[1:]]
+        try:
+            yield self.backend.synthesize_chunk(text_chunks[0], voice, native)
+            for future in later_chunks:
+                yield future.result()
+        finally:
+            for future in later_chunks:
+                future.cancel()
+
+    def fetch_chunk(self, text, voice, native):
+        self.rate_limiter.wait()
+        with RUN_METRICS.timer('tts chunk'):
+            audio, seconds = self.backend.synthesize_chunk(text, voice, native)
+            return [b''.join(audio)], seconds
+
+
+class AudioCache(object):
+    # Audio is stored once per (provider, voice, format, normalized text) and hard linked (or copied) into the
+    # audio output directory, so re-splitting cards or sharing units between trails does not re-bill the same speech
+    def __init__(self, directory, max_bytes=2 * 1024 ** 3):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.index_file = os.path.join(directory, 'index.json')
+        self.lock = threading.RLock()
+        self.key_locks = {}
+        self.hits, self.misses, self.adopted, self.evicted = 0, 0, 0, 0
+        self.unsaved = 0
+        os.makedirs(directory, exist_ok=True)
+        self.entries, self.targets = {}, {}
+        if os.path.isfile(self.index_file):
+            with open(file=self.index_file, mode='r', encoding='utf-8') as file:
+                index = json.load(file)
+            self.entries, self.targets = index['entries'], index['targets']
+
+    @staticmethod
+    def key(service, voice, audio_format, text):
+        normalized_text = ' '.join(text.split())
+        return hashlib.sha256(f'{service}\n{voice}\n{audio_format}\n{normalized_text}'.encode('utf-8')).hexdigest()
+
+    def speak(self, speaker: Speaker, file, text, changed=False):
+        # changed cards (sync mode) never keep an existing file, it holds the audio of their old text
+        voice = speaker.voice_for(text)
+        key = self.key(speaker.service, voice, speaker.audio_format, text)
+        target = os.path.abspath(file)
+        with self.lock:
+            key_lock = self.key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            if self.cached(key):
+                self.materialize(key, target)
+            elif changed or not self.adopt(target):
+                path = self.path(key, speaker)
+                speaker.speak(os.path.join(self.directory, path), text, voice)
+                self.add(key, path)
+                self.materialize(key, target)
+
+    def speak_batch(self, speaker: Speaker, items):
+        # Hits are linked straight away and the misses go to the speaker as one batch. Key locks are not held here,
+        # at worst the same text is synthesized twice at the same moment and the later clip replaces the entry.
+        # Returns the error of every item like Speaker.speak_batch, None where its audio is in place. items are
+        # (file, text, changed).
+        misses = {}
+        keys = []
+        for file, text, changed in items:
+            voice = speaker.voice_for(text)
+            key = self.key(speaker.service, voice, speaker.audio_format, text)
+            target = os.path.abspath(file)
+            keys.append(key)
+            if self.cached(key):
+                self.materialize(key, target)
+            elif changed or not self.adopt(target):
+                misses.setdefault(key, (text, voice, []))[2].append(target)
+        if not misses:
+            return [None] * len(items)
+        paths = {key: self.path(key, speaker) for key in misses}
+        errors = dict(zip(misses, speaker.speak_batch([(os.path.join(self.directory, paths[key]), text, voice) for key, (text, voice, _) in misses.items()])))
+        for key, (_, _, targets) in misses.items():
+            if errors[key] is not None:
+                continue
+            self.add(key, paths[key])
+            for target in targets:
+                self.materialize(key, target)
+        return [errors.get(key) for key in keys]
+
+    def cached(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and not os.path.isfile(os.path.join(self.directory, entry['file'])):
+                self.entries.pop(key)
+                entry = None
+            if entry is not None:
+                self.hits += 1
+            return entry is not None
+
+    def adopt(self, target):
+        # Audio generated before the cache existed is trusted for its own card like the filename check used to, but
+        # it is never filed under this text's key: the card may have been re-split since, so the file can say
+        # something else, and the shared index would hand it to every card with this text
+        if os.path.isfile(target) and target not in self.targets:
+            with self.lock:
+                self.adopted += 1
+            return True
+        return False
+
+    def path(self, key, speaker: Speaker):
+        os.makedirs(os.path.join(self.directory, key[:2]), exist_ok=True)
+        return os.path.join(key[:2], f'{key}.{speaker.extension}')
+
+    def add(self, key, path):
+        with self.lock:
+            self.misses += 1
+            self.entries[key] = {'file': path, 'size': os.path.getsize(os.path.join(self.directory, path)), 'last_used': time.time()}
+            self.evict(keep=key)
+            self.unsaved += 1
+            if self.unsaved >= 20:
+                self.save()
+
+    def materialize(self, key, target):
+        with self.lock:
+            entry = self.entries[key]
+            entry['last_used'] = time.time()
+            self.targets[target] = key
+        source = os.path.join(self.directory, entry['file'])
+        if os.path.isfile(target) and os.path.samefile(source, target):
+            return
+        if os.path.isfile(target):
+            os.remove(target)
+        self.link(source, target)
+
+    @staticmethod
+    def link(source, target):
+        try:
+            os.link(source, target)
+        except OSError:
+            shutil.copyfile(source, target)
+
+    def evict(self, keep=None):
+        total = sum(entry['size'] for entry in self.entries.values())
+        for key, entry in sorted(self.entries.items(), key=lambda item: item[1]['last_used']):
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            path = os.path.join(self.directory, entry['file'])
+            if os.path.isfile(path):
+                os.remove(path)
+            total -= entry['size']
+            self.entries.pop(key)
+            self.evicted += 1
+
+    def save(self):
+        with self.lock:
+            self.unsaved = 0
+            with open(file=f'{self.index_file}.part', mode='w', encoding='utf-8') as file:
+                json.dump({'entries': self.entries, 'targets': self.targets}, file)
+            os.replace(f'{self.index_file}.part', self.index_file)
+
+    def summary(self):
+        size = sum(entry['size'] for entry in self.entries.values()) / 1024 / 1024
+        return f'TTS cache: {self.hits} hits, {self.misses} misses, {self.adopted} existing files adopted, {self.evicted} evicted ({len(self.entries)} clips, {size:.1f} MB)'
 
 
 def safe_filename(text: str):
@@ -129,123 +1131,133 @@ def safe_filename(text: str):
     return os.path.join(dirname, filename + extension)
 
 
-def get_tag_type(tag: str):
-    pattern = r'<\s*([a-zA-Z0-9_-]+)[^>]*\/?>|<\/\s*([a-zA-Z0-9_-]+)\s*>'
-    matches = re.findall(pattern, tag)
-    if matches: return matches[0][0] if matches[0][0] else matches[0][1]
+# Comments, then tags (with the tag name captured once), then runs of text
+TOKEN_PATTERN = re.compile(r'<!--.*?-->|<(/?)\s*([a-zA-Z0-9_-]*)[^>]*>|[^<]+', re.DOTALL)
+VOID_TAGS = frozenset(('area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta', 'source', 'track', 'wbr'))
+SPLIT_BEFORE_TAGS = frozenset(('h1', 'h2', 'h3'))
+UNCLOSED_TAGS = ('a',)
+
+
+class Token(object):
+    __slots__ = ('kind', 'tag', 'html', 'is_open', 'is_close', 'is_void', 'words')
+
+    def __init__(self, kind, tag, html):
+        self.kind = kind
+        self.tag = tag
+        self.html = html
+        self.is_close = kind == 'close'
+        self.is_void = kind == 'self_closing' or (kind == 'open' and tag in VOID_TAGS)
+        self.is_open = kind == 'open' and not self.is_void
+        self.words = html.count(' ') + 1 if kind == 'text' else 0
+
+    def __repr__(self):
+        return f'Token({self.kind!r}, {self.tag!r}, {self.html!r})'
+
+
+def tokenize_html(html: str) -> list[Token]:
+    tokens = []
+    # Tags repeat constantly (</p>, <li>, <br/>...), so each distinct tag string only gets one shared Token
+    tag_tokens = {}
+    for match in TOKEN_PATTERN.finditer(html):
+        piece = match.group(0)
+        if piece[0] != '<':
+            tokens.append(Token('text', None, piece))
+            continue
+        token = tag_tokens.get(piece)
+        if token is None:
+            if not match.group(2):
+                token = Token('comment', None, piece)
+            elif match.group(1):
+                token = Token('close', match.group(2).lower(), piece)
+            elif piece.endswith('/>'):
+                token = Token('self_closing', match.group(2).lower(), piece)
+            else:
+                token = Token('open', match.group(2).lower(), piece)
+            tag_tokens[piece] = token
+        tokens.append(token)
+    return tokens
+
+
+def close_open_tag(open_tags: list[Token], tag: str):
+    if open_tags[-1].tag == tag:
+        open_tags.pop()
     else:
-        if re.search(r'<!--.+-->', tag):
-            return None
-        else:
-            raise Exception(f'Did not find a html tag in \'{tag}\'.')
+        while open_tags and open_tags[-1].tag in UNCLOSED_TAGS:
+            open_tags.pop()
+            if open_tags and open_tags[-1].tag == tag:
+                open_tags.pop()
+                break
 
 
-def parse_trees(html: str) -> list[list[str]]:
+def parse_trees(html: str) -> list[list[Token]]:
     trees = []
     ordered_html = []
-    current_text = ""
-    current_tag = ""
-    parsing_tag = False
     open_tags = []
-    for character in html:
-        if parsing_tag:
-            current_tag += character
-            if character == '>':
-                if current_text:
-                    ordered_html.append(current_text)
-                    current_text = ""
-                ordered_html.append(current_tag)
-                if current_tag.endswith('/>'):
-                    if not open_tags:
-                        trees.append(ordered_html)
-                        ordered_html = []
-                elif current_tag.startswith('</'):
-                    if open_tags:
-                        if open_tags[-1].startswith(f'<{get_tag_type(current_tag)}'):
-                            open_tags = open_tags[:-1]
-                        else:
-                            count = 0
-                            while get_tag_type(open_tags[-1]) in ['img', 'a', 'br', 'hr']:
-                                count += 1
-                                open_tags = open_tags[:-1]
-                                if open_tags[-1].startswith(f'<{get_tag_type(current_tag)}'):
-                                    open_tags = open_tags[:-1]
-                                    break
-                                if count > 100:
-                                    raise Exception(f'Expected to close the last open tag {open_tags[-1]}, but {current_tag} does not close it.')
-                    if not open_tags:
-                        trees.append(ordered_html)
-                        ordered_html = []
-                else:
-                    if current_tag != '<br>':
-                        open_tags.append(current_tag)
-                current_tag = ""
-                parsing_tag = False
-        elif character == '<':
-            current_tag += character
-            parsing_tag = True
-        else:
-            current_text += character
+    for token in tokenize_html(html):
+        ordered_html.append(token)
+        if token.is_open:
+            open_tags.append(token)
+            continue
+        if token.is_close and open_tags:
+            close_open_tag(open_tags, token.tag)
+        elif not token.is_void:
+            continue
+        if not open_tags:
+            trees.append(ordered_html)
+            ordered_html = []
     if ordered_html:
         trees.append(ordered_html)
     return trees
 
 
+# Only runs of two or more need replacing, a single space or line break is already what the substitution produces
+SPACE_RUN_PATTERN = re.compile(r' {2,}')
+NEWLINE_RUN_PATTERN = re.compile(r'\n{2,}')
+
+
+def normalize_card_text(text):
+    text = text.strip().replace('&nbsp;', ' ').replace('\xa0', '').replace(' \n ', '\n')
+    return NEWLINE_RUN_PATTERN.sub('\n', SPACE_RUN_PATTERN.sub(' ', text))
+
+
+def is_edge_whitespace(token: Token):
+    return token.tag == 'br' or token.html == ' '
+
+
 def convert_trees_to_dicts(trees, split_on_trees=True, try_split_after=0, split_on_opening_tags_callback=None):
     def create_card():
         nonlocal card_text, card_html, text_length
-        open_tags = []
-        for tag in card_html:
-            if '<' not in tag or '/>' in tag:
-                continue
-            if '</' in tag:
-                if get_tag_type(open_tags[-1]) == get_tag_type(tag):
-                    open_tags = open_tags[:-1]
-                else:
-                    count = 0
-                    while get_tag_type(open_tags[-1]) in ['br', 'hr', 'img', 'a']:
-                        count += 1
-                        open_tags = open_tags[:-1]
-                        if open_tags[-1].startswith(f'<{get_tag_type(tag)}'):
-                            open_tags = open_tags[:-1]
-                            break
-                        if count > 100:
-                            raise Exception(f'Expected to close the last open tag {open_tags[-1]}, but {tag} does not close it.')
-            else:
-                open_tags.append(tag)
-        card_html.extend([f'</{get_tag_type(tag)}>' for tag in reversed(open_tags) if get_tag_type(tag) not in ['br']])
-        while get_tag_type(card_html[0]) == 'br' or card_html[0] in [" "]: del card_html[0]
-        while get_tag_type(card_html[-1]) == 'br' or card_html[-1] in [" "]: del card_html[-1]
-        for tag in reversed(card_html):
-            if '<' not in tag: break
-            if get_tag_type(tag) == 'br': card_html.remove(tag)
-        for tag in card_html:
-            if '<' not in tag: break
-            if get_tag_type(tag) == 'br': card_html.remove(tag)
-
-        flashcards.append({'text': re.sub(r'\n+', '\n', re.sub(r' +', ' ', ' '.join(card_text).strip().replace('&nbsp;', ' ').replace('\xa0', '').replace(' \n ', '\n'))), 'html': ''.join(card_html)})
-        card_text, card_html, text_length = [], open_tags, 0
-
-    flashcards, card_text, card_html, text_length = [], [], [], 0
+        pieces = card_html + [Token('close', token.tag, f'</{token.tag}>') for token in reversed(open_tags)]
+        # Line breaks and lone spaces are dropped from the tags before the first and after the last piece of text
+        first = next((index for index, token in enumerate(pieces) if token.kind == 'text' and token.html != ' '), len(pieces))
+        last = next((index for index in range(len(pieces) - 1, -1, -1) if pieces[index].kind == 'text' and pieces[index].html != ' '), -1)
+        html = ''.join(token.html for index, token in enumerate(pieces) if first <= index <= last or not is_edge_whitespace(token))
+        flashcards.append({'text': normalize_card_text(' '.join(card_text)), 'html': html})
+        card_text, card_html, text_length = [], list(open_tags), 0
+
+    flashcards, card_text, card_html, text_length, open_tags = [], [], [], 0, []
     for tree in trees:
         if len(tree) > 1 and split_on_trees:
             if try_split_after and text_length < try_split_after:
                 pass
             else:
                 create_card()
-        for piece in tree:
-            if piece.startswith('<'):
-                if get_tag_type(piece) == 'br':
-                    card_text += '\n'
-                if try_split_after and text_length > try_split_after:
-                    if (piece.startswith('<h1') or piece.startswith('<h2') or piece.startswith('<h3') or (split_on_opening_tags_callback is not None and split_on_opening_tags_callback(piece))) and "/" not in piece:
-                        create_card()
-            else:
-                text_length += len(piece.split(' '))
-                card_text.append(piece)
-            card_html.append(piece)
+        for token in tree:
+            if token.kind == 'text':
+                text_length += token.words
+                card_text.append(token.html)
+            elif token.is_open:
+                if try_split_after and text_length > try_split_after and (token.tag in SPLIT_BEFORE_TAGS or (split_on_opening_tags_callback is not None and split_on_opening_tags_callback(token))):
+                    create_card()
+                open_tags.append(token)
+            elif token.is_close:
+                if open_tags:
+                    close_open_tag(open_tags, token.tag)
+            elif token.tag == 'br':
+                card_text.append('\n')
+            card_html.append(token)
         if card_text:
-            card_text += '\n'
+            card_text.append('\n')
 
     if card_html:
         create_card()
@@ -257,6 +1269,135 @@ def convert_trees_to_dicts(trees, split_on_trees=True, try_split_after=0, split_
     return flashcards
 
 
+WHITESPACE_RUN_PATTERN = re.compile(r'\s\s+')
+DEFAULT_STRIP_RULES = [
+    {
+        'name': 'navbar',
+        'description': 'The navbar when scraping articles',
+        'pattern': r'<nav.+?</nav>'
+    },
+    {
+        'name': 'accessibility_notice',
+        'description': 'A warning about screen readers struggling to parse the page content',
+        'pattern': r'<div class="box message info"><div class="inner"><div class="bd"><div class="media"><img class="img mtm" role="presentation" src="https://res\.cloudinary\.com/hy4kyit2a/image/upload/doc/trailhead/en-usb473bb5ea1b7e61dfb07e6a7e547de6b\.gif" alt="Note"><div class="mediaBd"><div class="message-media-content"><h2 id="accessibility"><span>Accessibility</span></h2><p>This \S+ requires some additional instructions for screen reader users\. To access a detailed screen reader version of this \S+, click the link below:</p><p><a href="\S+" rel="noreferrer noopener" target="_blank">Open Trailhead screen reader instructions</a>\.</p></div></div></div></div></div></div>'
+    },
+    {
+        'name': 'trail_together_video',
+        'description': 'The \'Follow along with an instructor/expert\' title, paragraph and video element',
+        'pattern': r'<h2 id="follow-along-with-trail-together"><span>Follow Along with Trail Together</span></h2><p>Want to follow along with an \S+ as you work through this step\? Take a look at this video.+?</p>(?:<p>|)<span><iframe width="\S+" height="\S+" src="\S+" allowfullscreen="" title="Video Content"></iframe></span>(?:<a id="hidden-content" href="#"></a>|)(?:</p>|)'
+    },
+    {
+        'name': 'clip_start_note',
+        'description': 'The note on where the Trail Together clip starts',
+        'pattern': r'<p>\(This clip starts at .+?, in case you want to rewind and watch the beginning of the step again\.\)</p>'
+    },
+    {
+        'name': 'related_badges',
+        'description': 'The Related Badges heading, paragraph and table',
+        'pattern': r'<h2 id="related-badges"><span>Related Badges</span></h2><p>Looking for more information\? Explore these related badges.+?</p><table.+?</tbody></table>'
+    },
+    {
+        'name': 'screen_reader_warning',
+        'description': 'The screen reader warning',
+        'pattern': r'<h2 id="accessibility"><span>Accessibility</span></h2>This unit requires some additional instructions for screen reader users\. To access a detailed screen reader version of this unit, click the link below\.<br><br><a href="https://developer\.salesforce\.com/files/accessibility/session_based_perms/session_based_access/index\.html" target="_blank" rel="noreferrer noopener"><u>Open Trailhead screen reader instructions</u></a>'
+    }
+]
+
+
+# Global flags like (?i) are only allowed at the very start of the combined pattern, and \1 would point at another rule's group
+GLOBAL_FLAGS_PATTERN = re.compile(r'\(\?[aiLmsux]+\)')
+NUMBERED_BACKREFERENCE_PATTERN = re.compile(r'(?<!\\)(?:\\\\)*\\[1-9]')
+
+
+class StripRule(object):
+    def __init__(self, name, pattern, description=''):
+        self.name = name
+        self.pattern = pattern
+        self.description = description
+        self.hits = 0
+        self.seconds = 0.0
+
+
+class StripRules(object):
+    # Boilerplate rules are combined into a single alternation so the unit HTML is only scanned once. The time spent
+    # scanning up to a match is attributed to the rule that matched, anything after the last match is only in the total.
+    def __init__(self, rules=()):
+        self.rules: dict[str, StripRule] = {}
+        self.pattern = None
+        self.seconds = 0.0
+        self.compile()
+        for rule in rules:
+            self.register(rule['name'], rule['pattern'], rule.get('description', ''))
+
+    def register(self, name, pattern, description=''):
+        # A rule has to work inside the combined alternation, where its groups are renumbered and global flags are
+        # no longer at the start, so both are rejected and the combined pattern is compiled here, not on the first page
+        re.compile(pattern)
+        if GLOBAL_FLAGS_PATTERN.match(pattern):
+            raise Exception(f'Strip rule {name} uses global flags, please scope them to the rule instead, e.g. (?i:...).')
+        if NUMBERED_BACKREFERENCE_PATTERN.search(pattern):
+            raise Exception(f'Strip rule {name} uses a numbered backreference, please name the group and use (?P=name) instead.')
+        previous = self.rules.get(name)
+        self.rules[name] = StripRule(name, pattern, description)
+        try:
+            self.compile()
+        except re.error as e:
+            if previous is None:
+                self.rules.pop(name)
+            else:
+                self.rules[name] = previous
+            self.compile()
+            raise Exception(f'Strip rule {name} does not combine with the other rules: {e}')
+
+    def unregister(self, name):
+        self.rules.pop(name, None)
+        self.compile()
+
+    def compile(self):
+        # The checkpoint keys pages on this, so flashcards extracted under different rules aren't served again
+        self.fingerprint = hashlib.sha256('\n'.join(f'{rule.name}\t{rule.pattern}' for rule in self.rules.values()).encode('utf-8')).hexdigest()
+        self.pattern = re.compile('|'.join(f'(?P<rule_{index}>{rule.pattern})' for index, rule in enumerate(self.rules.values()))) if self.rules else None
+
+    def load(self, file):
+        # A JSON list of {"name": ..., "pattern": ..., "description": ...}, a rule with "enabled": false removes a default rule of the same name
+        with open(file=file, mode='r', encoding='utf-8') as rules_file:
+            for rule in json.load(rules_file):
+                if rule.get('enabled', True):
+                    self.register(rule['name'], rule['pattern'], rule.get('description', ''))
+                else:
+                    self.unregister(rule['name'])
+
+    def reset(self):
+        self.seconds = 0.0
+        for rule in self.rules.values():
+            rule.hits, rule.seconds = 0, 0.0
+
+    def strip(self, html):
+        if not self.rules:
+            return html
+        rules = list(self.rules.values())
+        start = last = time.perf_counter()
+
+        def remove(match):
+            nonlocal last
+            now = time.perf_counter()
+            rule = rules[int(match.lastgroup[5:])]
+            rule.hits += 1
+            rule.seconds += now - last
+            last = now
+            return ''
+
+        html = self.pattern.sub(remove, html)
+        self.seconds += time.perf_counter() - start
+        return html
+
+    def summary(self):
+        return f'Boilerplate stripping: {self.seconds:.3f}s total, ' + ', '.join(f'{rule.name} {rule.hits} hits ({rule.seconds:.3f}s)' for rule in self.rules.values())
+
+
+STRIP_RULES = StripRules(DEFAULT_STRIP_RULES)
+
+
 def add_br_around_img_tags(html, add_before=True, add_after=True):
     if add_before:
         pattern = re.compile(f'(</?br/?>)?(</?img(?![^>]*</?img)[^>]*>)', re.IGNORECASE)
@@ -267,75 +1408,701 @@ def add_br_around_img_tags(html, add_before=True, add_after=True):
     return html
 
 
-def scrape_trailhead(url, output_dir, audio_dir, speaker: Speaker, split_after=500, credentials=None, redo_successes=False):
-    global browser
-
-    def login_trailhead():
-        global browser
-        wait_for_element(browser, 30, By.CSS_SELECTOR, '#onetrust-reject-all-handler').click()
-        shadow_root = browser.execute_script('return arguments[0].shadowRoot', wait_for_element(browser, 30, By.CSS_SELECTOR, '#contextnav'))
-        shadow_root = browser.execute_script('return arguments[0].shadowRoot', shadow_root.find_element(By.CSS_SELECTOR, 'div.contextnav__ctas-button-container.cta-primary > hgf-button'))
-        original_window_handle = browser.current_window_handle
-        browser.execute_script("arguments[0].click();", shadow_root.find_element(By.CSS_SELECTOR, 'a'))
-        new_tab_handle = None
-        for window_handle in browser.window_handles:
-            if window_handle != original_window_handle:
-                new_tab_handle = window_handle
+# Bump whenever the tokenizer, the card splitting or UnitPageParser change, so checkpointed pages are parsed again
+PARSER_VERSION = 1
+
+
+def create_flashcard_dicts(trail_title, module_title, unit_title, html, split_after=500, challenge_url=None):
+    RUN_METRICS.count('pages parsed')
+    RUN_METRICS.count('html characters', len(html))
+    with RUN_METRICS.timer('strip boilerplate'):
+        html = WHITESPACE_RUN_PATTERN.sub('', html.replace('\n', ''))
+        html = STRIP_RULES.strip(html)
+    with RUN_METRICS.timer('add_br_around_img_tags'):
+        html = add_br_around_img_tags(html, add_before=True, add_after=True)
+    with RUN_METRICS.timer('parse_trees'):
+        trees = parse_trees(html)
+    with RUN_METRICS.timer('convert_trees_to_dicts'):
+        flashcards = convert_trees_to_dicts(trees, split_on_trees=False, try_split_after=split_after)
+    RUN_METRICS.count('cards created', len(flashcards))
+    for index, flashcard in enumerate(flashcards, start=1):
+        flashcard['trail_title'] = trail_title
+        flashcard['module_title'] = module_title
+        flashcard['unit_title'] = unit_title
+        flashcard['card_index'] = str(index)
+
+    if challenge_url is not None and flashcards:
+        flashcards[-1]['html'] += f'<a href="{challenge_url}#challenge">Complete the Challenge!</a>'
+    return flashcards
+
+
+# Each of these scripts replaces a series of find_element/get_attribute calls, which are one WebDriver round-trip each
+UNIT_EXTRACTION_SCRIPT = """
+const title = document.querySelector('article > h1');
+return {
+    title: title ? title.innerText.trim() : '',
+    html: Array.from(document.querySelectorAll('article > .unit-content > *'), element => element.outerHTML).join(''),
+    breadcrumbs: Array.from(document.querySelectorAll('nav > ol > li'), item => item.querySelector('a') ? item.querySelector('a').innerText.trim() : ''),
+    challenge: document.querySelector('#challenge') !== null,
+    url: window.location.href
+};
+"""
+ARTICLE_EXTRACTION_SCRIPT = """
+const viewer = document.querySelector('c-hc-article-viewer');
+const article = viewer && viewer.shadowRoot ? viewer.shadowRoot.querySelector('div c-hc-documentation-article') : null;
+const content = article && article.shadowRoot ? article.shadowRoot.querySelector('div > div > content > div > div') : null;
+if (!content) return null;
+return {
+    html: Array.from(content.children, element => element.outerHTML).join(''),
+    challenge: document.querySelector('#challenge') !== null,
+    url: window.location.href
+};
+"""
+MODULE_UNIT_LINKS_SCRIPT = """
+return Array.from(document.querySelectorAll('a.tds-content-panel__unit-link'), link => link.href);
+"""
+EXPAND_TRAIL_PANELS_SCRIPT = WAIT_FOR_DOM_QUIET_JS + """
+const done = arguments[arguments.length - 1];
+let clicked = 0;
+for (const panel of document.querySelectorAll('div.tds-content-panel_body')) {
+    const button = panel.querySelector('button');
+    if (button) { button.click(); clicked++; }
+}
+if (!clicked) return done(0);
+waitForDomQuiet(arguments[0], arguments[1], () => done(clicked));
+"""
+TRAIL_EXTRACTION_SCRIPT = """
+const text = (root, selector) => { const element = root ? root.querySelector(selector) : null; return element ? element.innerText.trim() : ''; };
+let title = '';
+if (window.location.href.includes('trailmixes')) {
+    const header = document.querySelector('tds-content-header');
+    const summary = header && header.shadowRoot ? header.shadowRoot.querySelector('lwc-tds-content-summary') : null;
+    const tdsSummary = summary && summary.shadowRoot ? summary.shadowRoot.querySelector('lwc-tds-summary') : null;
+    title = text(tdsSummary ? tdsSummary.shadowRoot : null, 'div.body > div.content > lwc-tds-heading');
+} else {
+    title = text(document, 'h1');
+}
+return {
+    title: title,
+    panels: Array.from(document.querySelectorAll('div.tds-content-panel_body'), panel => {
+        const heading = panel.querySelector('h2');
+        const link = heading ? heading.querySelector('a') : null;
+        return {
+            type: text(panel, 'div:nth-child(2) > div:nth-child(2) > div'),
+            title: heading ? heading.innerText.trim() : '',
+            link: link ? link.href : null,
+            success: panel.querySelector('.tds-bg_success') !== null,
+            exam_weight: text(panel, 'div > div > p')
+        };
+    })
+};
+"""
+
+
+class UnitPageParser(HTMLParser):
+    # Pulls the same fields as UNIT_EXTRACTION_SCRIPT out of server rendered unit HTML, slicing .unit-content from the source
+    def __init__(self, page):
+        super().__init__()
+        self.page = page
+        self.line_offsets = [0] + [index + 1 for index, character in enumerate(page) if character == '\n']
+        self.stack = []
+        self.title, self.breadcrumbs, self.challenge = '', [], False
+        self.content_start, self.content_end = None, None
+        self.in_title, self.in_breadcrumb = False, False
+
+    def source_offset(self):
+        line, column = self.getpos()
+        return self.line_offsets[line - 1] + column
+
+    def handle_starttag(self, tag, attrs):
+        attributes = dict(attrs)
+        if attributes.get('id') == 'challenge':
+            self.challenge = True
+        parent = self.stack[-1][0] if self.stack else None
+        if tag == 'h1' and parent == 'article' and not self.title:
+            self.in_title = True
+        elif tag == 'div' and parent == 'article' and 'unit-content' in (attributes.get('class') or '').split() and self.content_start is None:
+            self.content_start = self.source_offset() + len(self.get_starttag_text())
+            tag = 'unit-content'
+        elif tag == 'li' and parent == 'ol' and len(self.stack) > 1 and self.stack[-2][0] == 'nav':
+            self.breadcrumbs.append('')
+        elif tag == 'a' and parent == 'li' and len(self.stack) > 2 and self.stack[-3][0] == 'nav':
+            self.in_breadcrumb = True
+        if tag not in VOID_TAGS:
+            self.stack.append((tag, self.source_offset()))
+
+    def handle_endtag(self, tag):
+        for index in range(len(self.stack) - 1, -1, -1):
+            if self.stack[index][0] == tag or (tag == 'div' and self.stack[index][0] == 'unit-content'):
+                if self.stack[index][0] == 'unit-content' and self.content_end is None:
+                    self.content_end = self.source_offset()
+                del self.stack[index:]
+                break
+        if tag == 'h1':
+            self.in_title = False
+        elif tag == 'a':
+            self.in_breadcrumb = False
+
+    def handle_data(self, data):
+        if self.in_title:
+            self.title += data
+        elif self.in_breadcrumb:
+            self.breadcrumbs[-1] += data
+
+
+class HttpUnitFetcher(object):
+    # Downloads unit pages over a pooled keep-alive connection with the browser's cookies, a page whose content
+    # isn't in the served HTML (client side rendered, login wall...) returns None so the caller can use the browser
+    def __init__(self, cookies, user_agent=None, workers=8, timeout=30):
+        self.cookies = cookies
+        self.workers = workers
+        self.headers = {'User-Agent': user_agent} if user_agent else {}
+        self.pool = urllib3.PoolManager(maxsize=workers, block=True, timeout=timeout, retries=urllib3.Retry(total=2, backoff_factor=0.5))
+        self.fetched, self.fallbacks = 0, 0
+
+    def cookie_header(self, url):
+        parts = urllib.parse.urlsplit(url)
+        host, path = parts.hostname or '', parts.path or '/'
+        return '; '.join(f'{cookie["name"]}={cookie["value"]}' for cookie in self.cookies
+                         if (host == cookie['domain'].lstrip('.') or host.endswith('.' + cookie['domain'].lstrip('.')))
+                         and path.startswith(cookie.get('path', '/')) and (parts.scheme == 'https' or not cookie.get('secure')))
+
+    def fetch(self, url):
+        headers = dict(self.headers)
+        cookies = self.cookie_header(url)
+        if cookies:
+            headers['Cookie'] = cookies
+        try:
+            response = self.pool.request('GET', url, headers=headers)
+        except urllib3.exceptions.HTTPError as e:
+            print(f'Fetching {url} failed, falling back to the browser.', e)
+            self.fallbacks += 1
+            return None
+        if response.status != 200:
+            self.fallbacks += 1
+            return None
+        parser = UnitPageParser(response.data.decode('utf-8', errors='replace'))
+        parser.feed(parser.page)
+        parser.close()
+        if not parser.title.strip() or parser.content_start is None or parser.content_end is None or parser.content_end <= parser.content_start:
+            self.fallbacks += 1
+            return None
+        self.fetched += 1
+        return {'title': parser.title.strip(), 'html': parser.page[parser.content_start:parser.content_end], 'breadcrumbs': [breadcrumb.strip() for breadcrumb in parser.breadcrumbs], 'challenge': parser.challenge, 'url': url}
+
+    def fetch_all(self, urls):
+        with RUN_METRICS.timer('http fetch'), ThreadPoolExecutor(max_workers=self.workers) as pool:
+            return list(pool.map(self.fetch, urls))
+
+    def summary(self):
+        return f'HTTP fast path: {self.fetched} unit pages fetched without the browser, {self.fallbacks} fell back to the browser'
+
+
+class CheckpointStore(object):
+    # Every extracted unit/article page and its flashcards are committed as soon as they are scraped, so a crashed or
+    # repeated run serves them from here instead of navigating again. Stale pages are re-scraped, but when their
+    # content hash has not changed the stored flashcards are reused instead of being parsed and split again.
+    def __init__(self, file, max_age_hours=168):
+        self.max_age = max_age_hours * 3600
+        self.lock = threading.Lock()
+        self.hits, self.stores = 0, 0
+        self.connection = sqlite3.connect(file, check_same_thread=False)
+        with self.lock, self.connection:
+            # Checkpoints from before pages were keyed on the settings can't be trusted, so they are dropped
+            if 'split_after' in [column[1] for column in self.connection.execute('PRAGMA table_info(pages)')]:
+                self.connection.execute('DROP TABLE pages')
+            self.connection.execute('CREATE TABLE IF NOT EXISTS pages (url TEXT PRIMARY KEY, settings TEXT, content_hash TEXT, page TEXT, flashcards TEXT, updated REAL)')
+            self.connection.execute('CREATE TABLE IF NOT EXISTS links (url TEXT PRIMARY KEY, links TEXT, updated REAL)')
+            self.connection.execute('CREATE TABLE IF NOT EXISTS units (source TEXT, unit TEXT, activity TEXT, fingerprint TEXT, fronts TEXT, updated REAL, PRIMARY KEY (source, unit))')
+
+    @staticmethod
+    def content_hash(page):
+        return hashlib.sha256(page['html'].encode('utf-8')).hexdigest()
+
+    def fresh(self, updated):
+        return time.time() - updated < self.max_age
+
+    @staticmethod
+    def settings(split_after):
+        # Everything besides the page itself that decides which flashcards come out of it
+        return f'{split_after}\t{PARSER_VERSION}\t{STRIP_RULES.fingerprint}'
+
+    def get_page(self, url, split_after, page=None, count=True):
+        with self.lock:
+            row = self.connection.execute('SELECT settings, content_hash, page, flashcards, updated FROM pages WHERE url = ?', (url,)).fetchone()
+        if row is None or row[0] != self.settings(split_after):
+            return None
+        if page is None and not self.fresh(row[4]):
+            return None
+        if page is not None and self.content_hash(page) != row[1]:
+            return None
+        if count:
+            with self.lock:
+                self.hits += 1
+        return {'page': json.loads(row[2]), 'flashcards': json.loads(row[3])}
+
+    def put_page(self, url, split_after, page, flashcards):
+        with self.lock, self.connection:
+            self.connection.execute('INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?)', (url, self.settings(split_after), self.content_hash(page), json.dumps(page), json.dumps(flashcards), time.time()))
+            self.stores += 1
+
+    def get_links(self, url):
+        with self.lock:
+            row = self.connection.execute('SELECT links, updated FROM links WHERE url = ?', (url,)).fetchone()
+        return json.loads(row[0]) if row is not None and self.fresh(row[1]) else None
+
+    def put_links(self, url, links):
+        with self.lock, self.connection:
+            self.connection.execute('INSERT OR REPLACE INTO links VALUES (?, ?, ?)', (url, json.dumps(links), time.time()))
+
+    def get_units(self, source):
+        with self.lock:
+            rows = self.connection.execute('SELECT unit, activity, fingerprint, fronts FROM units WHERE source = ?', (source,)).fetchall()
+        return {unit: {'activity': activity, 'fingerprint': fingerprint, 'fronts': json.loads(fronts)} for unit, activity, fingerprint, fronts in rows}
+
+    def put_units(self, source, units):
+        with self.lock, self.connection:
+            self.connection.execute('DELETE FROM units WHERE source = ?', (source,))
+            self.connection.executemany('INSERT INTO units VALUES (?, ?, ?, ?, ?, ?)', [(source, unit, entry['activity'], entry['fingerprint'], json.dumps(entry['fronts']), time.time()) for unit, entry in units.items()])
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+    def summary(self):
+        return f'Checkpoint: {self.hits} pages served from the checkpoint, {self.stores} pages scraped and saved'
+
+
+class SourceSync(object):
+    # Fingerprints the rows written for every unit of one source and compares them with the previous sync, so only
+    # added and changed units go to the delta CSV and get their audio regenerated. Units of activities that were not
+    # scraped this time (completed on Trailhead and skipped) are carried over rather than reported as removed.
+    def __init__(self, checkpoint: CheckpointStore, source):
+        self.checkpoint = checkpoint
+        self.source = source
+        self.previous = checkpoint.get_units(source)
+        self.current = {}
+        self.added, self.changed, self.unchanged, self.removed = 0, 0, 0, []
+
+    @staticmethod
+    def activity_key(content_dicts):
+        # The link alone isn't unique, an Exam Weight activity's "link" is its weight (e.g. "10%")
+        return f'{content_dicts["type"]}\t{content_dicts.get("module_title", "")}\t{content_dicts["link"]}'
+
+    def compare(self, content_dicts, flashcards):
+        activity = content_dicts['link']
+        units = {}
+        for flashcard in flashcards:
+            units.setdefault(flashcard['unit_title'], []).append(flashcard)
+        delta_units = set()
+        for unit_title, unit_flashcards in units.items():
+            rows = [format_flashcard_row(flashcard, '', False) for flashcard in unit_flashcards]
+            unit = f'{self.activity_key(content_dicts)}\t{unit_title}'
+            fingerprint = hashlib.sha256(''.join(rows).encode('utf-8')).hexdigest()
+            self.current[unit] = {'activity': activity, 'fingerprint': fingerprint, 'fronts': [row.split('\t', 1)[0] for row in rows]}
+            previous = self.previous.get(unit)
+            if previous is None:
+                self.added += 1
+                delta_units.add(unit_title)
+            elif previous['fingerprint'] != fingerprint:
+                self.changed += 1
+                delta_units.add(unit_title)
+            else:
+                self.unchanged += 1
+        return [flashcard['unit_title'] in delta_units for flashcard in flashcards]
+
+    def finish(self, skipped_activities):
+        current_fronts = {front for entry in self.current.values() for front in entry['fronts']}
+        for unit, entry in self.previous.items():
+            if unit in self.current:
+                continue
+            if entry['activity'] in skipped_activities:
+                self.current[unit] = entry
+            else:
+                self.removed.extend(front for front in entry['fronts'] if front not in current_fronts)
+        self.checkpoint.put_units(self.source, self.current)
+        return self.removed
+
+    def summary(self):
+        return f'Sync: {self.added} units added, {self.changed} changed, {self.unchanged} unchanged, {len(self.removed)} cards removed'
+
+
+class DeadLetters(object):
+    # Activities and audio clips that still failed after every retry. They are saved next to the CSVs as soon as the list
+    # changes, and a run with retry_dead_letters=True retries only them, writing the recovered cards to
+    # "<name> (retried).csv" for import. An entry is dropped as soon as its activity or clip succeeds in any run.
+    def __init__(self, file):
+        self.file = file
+        self.lock = threading.Lock()
+        self.entries = []
+        self.added, self.resolved = 0, 0
+        if os.path.isfile(file):
+            with open(file=file, mode='r', encoding='utf-8') as dead_letter_file:
+                self.entries = json.load(dead_letter_file)
+
+    @staticmethod
+    def key(entry):
+        # An activity is identified by its link and a clip by its file, both within the CSV they belong in
+        return entry['kind'], entry['source_title'], entry.get('link'), entry.get('file')
+
+    def add(self, entry):
+        with self.lock:
+            self.entries = [existing for existing in self.entries if self.key(existing) != self.key(entry)]
+            self.entries.append(dict(entry, failed_at=time.strftime('%Y-%m-%d %H:%M:%S')))
+            self.added += 1
+            self.write()
+
+    def resolve(self, entry):
+        with self.lock:
+            entries = [existing for existing in self.entries if self.key(existing) != self.key(entry)]
+            if len(entries) != len(self.entries):
+                self.entries = entries
+                self.resolved += 1
+                self.write()
+
+    def add_activity(self, source, source_title, module_order, content_dicts, error):
+        self.add({'kind': 'activity', 'source': source, 'source_title': source_title, 'link': content_dicts['link'], 'activity': dict(content_dicts, module_order=module_order), 'error': str(error)})
+
+    def add_audio(self, source_title, file, flashcard, error):
+        self.add({'kind': 'audio', 'source_title': source_title, 'file': file, 'flashcard': flashcard, 'error': str(error)})
+
+    def resolve_activity(self, source_title, link):
+        self.resolve({'kind': 'activity', 'source_title': source_title, 'link': link})
+
+    def resolve_audio(self, source_title, file):
+        self.resolve({'kind': 'audio', 'source_title': source_title, 'file': file})
+
+    def pending(self):
+        with self.lock:
+            return list(self.entries)
+
+    def write(self):
+        # Called with the lock held. An empty list removes the file, so its presence alone says something still needs retrying.
+        if not self.entries:
+            if os.path.isfile(self.file):
+                os.remove(self.file)
+            return
+        with open(file=f'{self.file}.part', mode='w', encoding='utf-8') as dead_letter_file:
+            json.dump(self.entries, dead_letter_file, indent=2)
+        os.replace(f'{self.file}.part', self.file)
+
+    def summary(self):
+        resolved = f', {self.resolved} resolved' if self.resolved else ''
+        if not self.entries:
+            return f'Dead letters: nothing failed{resolved}'
+        return f'Dead letters: {self.added} new{resolved}, {len(self.entries)} in {self.file}, run again with retry_dead_letters=True to retry only them'
+
+
+PARALLEL_ACTIVITY_TYPES = ['Module', 'Project', 'Article']
+# Only these load pages, the other activity types become link cards without touching the browser or the network
+BROWSER_ACTIVITY_TYPES = ['Module', 'Project', 'Article', 'Unit']
+COOKIE_FIELDS = ['name', 'value', 'domain', 'path', 'secure', 'httpOnly', 'sameSite', 'expires']
+
+
+def set_cookies(driver: selenium.webdriver.Chrome, cookies):
+    driver.execute_cdp_cmd('Network.setCookies', {'cookies': [{key: cookie[key] for key in COOKIE_FIELDS if key in cookie and not (key == 'expires' and cookie.get('session'))} for cookie in cookies]})
+
+
+def copy_session(source: selenium.webdriver.Chrome, target: selenium.webdriver.Chrome):
+    # Network.getAllCookies covers every domain (trailhead, help.salesforce.com...), not only the current page's
+    set_cookies(target, source.execute_cdp_cmd('Network.getAllCookies', {})['cookies'])
+
+
+def open_worker_browser(source: selenium.webdriver.Chrome):
+    driver = undetected_chromedriver.Chrome()
+    copy_session(source, driver)
+    return driver
+
+
+# How long a confirmed login is trusted before a warm browser checks it again
+SESSION_CHECK_TIMEOUT = 10
+SESSION_RECHECK_SECONDS = 30 * 60
+session_checked_at = None
+
+
+def save_session(driver: selenium.webdriver.Chrome, file):
+    # Chrome's profile drops session cookies when it closes, so they are kept here as well. The file holds live
+    # login cookies and is only readable by the current user.
+    cookies = driver.execute_cdp_cmd('Network.getAllCookies', {})['cookies']
+    with open(os.open(f'{file}.part', os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), mode='w', encoding='utf-8') as handle:
+        json.dump(cookies, handle)
+    os.replace(f'{file}.part', file)
+
+
+def load_session(driver: selenium.webdriver.Chrome, file):
+    if not os.path.isfile(file):
+        return 0
+    with open(file, encoding='utf-8') as handle:
+        cookies = [cookie for cookie in json.load(handle) if cookie.get('session') or cookie.get('expires', 0) > time.time()]
+    set_cookies(driver, cookies)
+    return len(cookies)
+
+
+def is_logged_in(driver: selenium.webdriver.Chrome):
+    # Logged out visitors are redirected away from /today, so whichever happens first settles it
+    driver.get('https://trailhead.salesforce.com/today')
+    try:
+        wait_until(driver, SESSION_CHECK_TIMEOUT, 'session check', lambda driver: driver.find_elements(By.CSS_SELECTOR, 'thtoday-page') or '/today' not in driver.current_url)
+    except TimeoutException:
+        return False
+    return bool(driver.find_elements(By.CSS_SELECTOR, 'thtoday-page'))
+
+
+CONSENT_BANNER_TIMEOUT = 5
+
+
+def login_trailhead(driver: selenium.webdriver.Chrome, credentials):
+    # The cookie banner only shows up until its consent cookie is set, which the persistent profile and saved session keep
+    try:
+        wait_for_element(driver, CONSENT_BANNER_TIMEOUT, By.CSS_SELECTOR, '#onetrust-reject-all-handler').click()
+    except TimeoutException:
+        pass
+    shadow_root = driver.execute_script('return arguments[0].shadowRoot', wait_for_element(driver, WAIT_TIMEOUT, By.CSS_SELECTOR, '#contextnav'))
+    shadow_root = driver.execute_script('return arguments[0].shadowRoot', shadow_root.find_element(By.CSS_SELECTOR, 'div.contextnav__ctas-button-container.cta-primary > hgf-button'))
+    original_window_handle = driver.current_window_handle
+    driver.execute_script("arguments[0].click();", shadow_root.find_element(By.CSS_SELECTOR, 'a'))
+    new_tab_handle = None
+    for window_handle in driver.window_handles:
+        if window_handle != original_window_handle:
+            new_tab_handle = window_handle
+            break
+    driver.close()
+    driver.switch_to.window(new_tab_handle)
+    wait_for_page_ready(driver, 'login page ready')
+    shadow_root = driver.execute_script('return arguments[0].shadowRoot', wait_for_element(driver, WAIT_TIMEOUT, By.CSS_SELECTOR, "idx-standard-login-page"))
+    shadow_root = driver.execute_script('return arguments[0].shadowRoot', shadow_root.find_element(By.CSS_SELECTOR, 'lwc-idx-user-login'))
+    wait_for_element(shadow_root, WAIT_TIMEOUT, By.CSS_SELECTOR, 'button.idp-button.idp-button--google').click()
+    wait_for_element(driver, WAIT_TIMEOUT, By.CSS_SELECTOR, '#identifierId').send_keys(credentials['username'])
+    driver.find_element(By.CSS_SELECTOR, '#identifierNext').click()
+    wait_for_element(driver, WAIT_TIMEOUT, By.CSS_SELECTOR, 'input[type=password]').send_keys(credentials['password'])
+    driver.find_element(By.CSS_SELECTOR, '#passwordNext').click()
+    wait_for_element(driver, WAIT_TIMEOUT, By.CSS_SELECTOR, 'thtoday-page')
+
+
+def start_browser(credentials=None, profile_dir='', session_file=''):
+    # Reuses the open browser and only logs in when neither the Chrome profile nor the saved cookies still hold a session
+    global browser, session_checked_at
+    if browser is not None and session_checked_at is not None and time.monotonic() - session_checked_at < SESSION_RECHECK_SECONDS:
+        return browser
+    start = time.perf_counter()
+    if browser is None:
+        browser = undetected_chromedriver.Chrome(user_data_dir=profile_dir or None)
+        browser.maximize_window()
+        if session_file:
+            load_session(browser, session_file)
+    if is_logged_in(browser):
+        print(f'Reused the saved Trailhead session ({time.perf_counter() - start:.1f}s)')
+    else:
+        browser.get('https://trailhead.salesforce.com/')
+        if credentials is not None:
+            login_trailhead(browser, credentials)
+        else:
+            input('Please log in, then press the enter key in the terminal!')
+        print(f'Logged into Trailhead ({time.perf_counter() - start:.1f}s)')
+    if session_file:
+        save_session(browser, session_file)
+    session_checked_at = time.monotonic()
+    return browser
+
+
+def close_browser(session_file=''):
+    global browser, session_checked_at
+    if browser is None:
+        return
+    if session_file:
+        save_session(browser, session_file)
+    browser.quit()
+    browser, session_checked_at = None, None
+
+
+def format_flashcard_row(flashcard, filepath, audio, audio_type='audio/wav'):
+    return (
+        f'{flashcard["trail_title"] + ' > ' if flashcard["trail_title"] else ''}{flashcard["module_title"] + ' > ' if flashcard["module_title"] else ''}{flashcard["unit_title"]}: {flashcard["card_index"]}\t' +
+        f'{flashcard["html"]}\t' +
+        (f'<audio controls=""><source src="{filepath}" type="{audio_type}"></audio>' if audio else '') + '\t' +
+        (f'[sound:{filepath}]' if audio else '') + '\t' +
+        f'Incremental_Learning::Salesforce::{'Trail::' + flashcard["trail_title"].replace(' ', '_') + '::' if flashcard["trail_title"] else ''}{('Module::' + (flashcard["module_index"] + '_' if flashcard["module_index"] else '') + (flashcard["module_title"].replace(' ', '_') + '::' if flashcard["module_title"] else '') if flashcard["module_title"] else "")}{('Unit::' + (flashcard["unit_index"] + '_' if flashcard["unit_index"] else '') + (flashcard["unit_title"].replace(' ', '_') if flashcard["unit_title"] else '')) if flashcard["unit_title"] else ""}{'::' + flashcard["card_index"] if flashcard["card_index"] else ''}\n'
+    )
+
+
+class FlashcardWriter(object):
+    # Cards are handed over as soon as each activity is scraped. Their audio is synthesized in the background while
+    # the browser moves on, and rows are appended to the CSV in order as soon as the audio in front of them is done.
+    def __init__(self, output_dir, audio_dir, speaker: Speaker = None, audio_cache: AudioCache = None, tts_workers=4, started=None, audio_jobs=None, pool=None, name=None, delta=False, dead_letters: DeadLetters = None, source_title=None):
+        self.output_dir = output_dir
+        self.audio_dir = audio_dir
+        self.speaker = speaker
+        self.audio_cache = audio_cache
+        # Writers for several CSVs can share a pool and job list so a clip needed by more than one is synthesized once
+        self.owns_pool = pool is None
+        self.pool = pool or ThreadPoolExecutor(max_workers=max(1, tts_workers))
+        self.audio_jobs = audio_jobs if audio_jobs is not None else {}
+        self.name = name
+        # Clips that fail every attempt are recorded under source_title (the name of the CSV they belong in)
+        self.dead_letters = dead_letters
+        self.source_title = source_title
+        # In sync mode a .delta.csv with only the added and changed cards is written next to the full CSV
+        self.delta = delta
+        self.delta_file = None
+        self.delta_written = 0
+        # Short cards waiting to be synthesized together in one SSML request (Azure only)
+        self.batch = []
+        self.batch_started = None
+        self.pending = collections.deque()
+        self.file = None
+        self.written = 0
+        self.started = started or time.perf_counter()
+        self.first_card_seconds = None
+
+    def add(self, flashcards, changed=None):
+        for index, flashcard in enumerate(flashcards):
+            in_delta = changed[index] if changed is not None else False
+            filepath = f'{safe_filename(flashcard["unit_title"] + '_' + flashcard["card_index"])}.{self.speaker.file_extension if self.speaker is not None else 'wav'}'
+            # Several cards can share a filename (e.g. Exam Weight_1), only the first one is synthesized
+            if self.speaker is not None and filepath not in self.audio_jobs:
+                # The existing file of a changed card holds the old text, the cache handles this through its text key
+                if self.audio_cache is None and not in_delta and os.path.isfile(f'{self.audio_dir}{filepath}'):
+                    self.audio_jobs[filepath] = None
+                elif self.speaker.can_batch(flashcard['text']):
+                    self.audio_jobs[filepath] = self.queue_batch(f'{self.audio_dir}{filepath}', flashcard['text'], in_delta)
+                elif self.audio_cache is not None:
+                    self.audio_jobs[filepath] = self.pool.submit(self.audio_cache.speak, self.speaker, f'{self.audio_dir}{filepath}', flashcard['text'], in_delta)
+                else:
+                    self.audio_jobs[filepath] = self.pool.submit(self.speaker.speak, f'{self.audio_dir}{filepath}', flashcard['text'])
+            self.pending.append((flashcard, filepath, in_delta))
+        if self.batch and time.monotonic() - self.batch_started >= SSML_BATCH_WAIT:
+            self.submit_batch()
+        self.flush(block=False)
+
+    def queue_batch(self, file, text, changed=False):
+        future = Future()
+        if not self.batch:
+            self.batch_started = time.monotonic()
+        self.batch.append((file, text, changed, future))
+        if len(self.batch) >= self.speaker.batch_size:
+            self.submit_batch()
+        return future
+
+    def submit_batch(self):
+        if self.batch:
+            batch, self.batch = self.batch, []
+            self.pool.submit(self.speak_batch, batch)
+
+    def speak_batch(self, batch):
+        # Every card's future gets its own outcome, a card that failed doesn't take the rest of its batch with it
+        try:
+            if self.audio_cache is not None:
+                errors = self.audio_cache.speak_batch(self.speaker, [(file, text, changed) for file, text, changed, _ in batch])
+            else:
+                errors = self.speaker.speak_batch([(file, text, self.speaker.voice_for(text)) for file, text, _, _ in batch])
+        except Exception as e:
+            errors = [e] * len(batch)
+        for (_, _, _, future), error in zip(batch, errors):
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(None)
+
+    def flush(self, block=True):
+        if block:
+            self.submit_batch()
+        while self.pending:
+            flashcard, filepath, in_delta = self.pending[0]
+            job = self.audio_jobs.get(filepath)
+            if job is not None and not block and not job.done():
                 break
-        browser.close()
-        browser.switch_to.window(new_tab_handle)
-        time.sleep(2)
-        shadow_root = browser.execute_script('return arguments[0].shadowRoot', wait_for_element(browser, 30, By.CSS_SELECTOR, "idx-standard-login-page"))
-        shadow_root = browser.execute_script('return arguments[0].shadowRoot', shadow_root.find_element(By.CSS_SELECTOR, 'lwc-idx-user-login'))
-        wait_for_element(shadow_root, 30, By.CSS_SELECTOR, 'button.idp-button.idp-button--google').click()
-        wait_for_element(browser, 30, By.CSS_SELECTOR, '#identifierId').send_keys(credentials['username'])
-        browser.find_element(By.CSS_SELECTOR, '#identifierNext').click()
-        wait_for_element(browser, 30, By.CSS_SELECTOR, 'input[type=password]').send_keys(credentials['password'])
-        browser.find_element(By.CSS_SELECTOR, '#passwordNext').click()
-        wait_for_element(browser, 30, By.CSS_SELECTOR, 'thtoday-page')
+            self.pending.popleft()
+            audio = False
+            if self.speaker is not None:
+                if job is None:
+                    audio = True
+                else:
+                    try:
+                        job.result()
+                        audio = True
+                        if self.dead_letters is not None:
+                            self.dead_letters.resolve_audio(self.source_title or self.name or flashcard['unit_title'], f'{self.audio_dir}{filepath}')
+                    except Exception as e:
+                        if self.dead_letters is not None:
+                            print(f'Audio generation failed for {filepath}, it is added to the dead letters to retry on the next run.', e)
+                            self.dead_letters.add_audio(self.source_title or self.name or flashcard['unit_title'], f'{self.audio_dir}{filepath}', flashcard, e)
+                        else:
+                            print(f'Audio generation failed for {filepath}! You will need to rerun the script to retry it (existing audio files will not be recreated).', e)
+                        if os.path.isfile(f'{self.audio_dir}{filepath}'):
+                            os.remove(f'{self.audio_dir}{filepath}')
+            self.write_row(flashcard, filepath, audio, in_delta)
+
+    def write_row(self, flashcard, filepath, audio, in_delta=False):
+        if self.file is None:
+            self.name = self.name or (flashcard["trail_title"] if flashcard["trail_title"] else flashcard["module_title"] if flashcard["module_title"] else flashcard["unit_title"])
+            self.file = open(file=f'{self.output_dir}{self.name}.csv', mode='w', encoding='utf-8')
+            if self.delta:
+                # Always (re)created, an empty delta means nothing changed since the last sync
+                self.delta_file = open(file=f'{self.output_dir}{self.name}.delta.csv', mode='w', encoding='utf-8')
+            self.first_card_seconds = time.perf_counter() - self.started
+        self.written += 1
+        print(f'Writing cards: {self.written} ({len(self.pending)} waiting for audio)')
+        with RUN_METRICS.timer('csv write'):
+            row = format_flashcard_row(flashcard, filepath, audio, self.speaker.mime_type if self.speaker is not None else 'audio/wav')
+            self.file.write(row)
+            self.file.flush()
+            if self.delta_file is not None and in_delta:
+                self.delta_written += 1
+                self.delta_file.write(row)
+                self.delta_file.flush()
+
+    def write_removed(self, fronts):
+        # Anki can't delete notes through an import, so the fronts of removed cards are listed for a manual cleanup
+        if self.name is None:
+            return
+        with open(file=f'{self.output_dir}{self.name}.removed.txt', mode='w', encoding='utf-8') as file:
+            file.writelines(f'{front}\n' for front in fronts)
+
+    def close(self):
+        self.flush(block=True)
+        if self.owns_pool:
+            self.pool.shutdown()
+        if self.file is not None:
+            self.file.close()
+        if self.delta_file is not None:
+            self.delta_file.close()
+        print(self.summary())
+
+    def summary(self):
+        first_card = f'{self.first_card_seconds:.1f}s' if self.first_card_seconds is not None else 'never'
+        delta = f' ({self.delta_written} in the delta CSV)' if self.delta else ''
+        return f'Wrote {self.written} cards{delta}, first card after {first_card}, total {time.perf_counter() - self.started:.1f}s'
+
+
+def scrape_sources(urls, output_dir, audio_dir, speaker: Speaker, split_after=500, credentials=None, redo_successes=False, tts_workers=4, audio_cache: AudioCache = None, scrape_workers=1, http_fast_path=False, http_workers=8, checkpoint: CheckpointStore = None, incremental_sync=False, retry_policy: RetryPolicy = None, dead_letters: DeadLetters = None, retry_dead_letters=False):
+    # Scrapes every Trailmix, Trail or Module URL into its own CSV. A module, project or article that appears in several
+    # sources is scraped once, the jobs run in the order the CSVs need them and the audio is shared between the CSVs.
+    # An activity that fails every attempt of retry_policy is left out and added to dead_letters. With retry_dead_letters
+    # urls is ignored and only the dead letters are retried, each source's recovered cards going to "<name> (retried).csv".
+    retry_policy = retry_policy or RetryPolicy(4, failure_threshold=3, cooldown=120)
+    started = time.perf_counter()
 
     def scrape_trail_links():
-        trail_title = None
         if 'trailmixes' in browser.current_url:
-            shadow_root = browser.execute_script('return arguments[0].shadowRoot', wait_for_element(browser, 30, By.CSS_SELECTOR, 'tds-content-header'))
-            shadow_root = browser.execute_script('return arguments[0].shadowRoot', shadow_root.find_element(By.CSS_SELECTOR, 'lwc-tds-content-summary'))
-            shadow_root = browser.execute_script('return arguments[0].shadowRoot', shadow_root.find_element(By.CSS_SELECTOR, 'lwc-tds-summary'))
-            trail_title = shadow_root.find_element(By.CSS_SELECTOR, 'div.body > div.content > lwc-tds-heading').text.strip()
-        else:
-            trail_title = browser.find_element(By.CSS_SELECTOR, 'h1').text.strip()
+            wait_for_element(browser, WAIT_TIMEOUT, By.CSS_SELECTOR, 'tds-content-header')
+        start = time.perf_counter()
+        browser.execute_async_script(EXPAND_TRAIL_PANELS_SCRIPT, DOM_QUIET_MS, min(WAIT_TIMEOUT, 25) * 1000)
+        WAIT_TELEMETRY.record('expand trail panels', time.perf_counter() - start)
+        trail = run_script(browser, 'trail extraction', TRAIL_EXTRACTION_SCRIPT)
+        trail_title = trail['title']
+        source_titles[browser.current_url] = trail_title
 
         content_dicts = []
-        modules_elements = browser.find_elements(By.CSS_SELECTOR, 'div.tds-content-panel_body')
-        _ = 0
-        while _ < len(modules_elements):
-            element = modules_elements[_]
-            _ += 1
-            content_text = element.find_element(By.CSS_SELECTOR, 'div:nth-child(2) > div:nth-child(2) > div').text.strip()
-            try:
-                element.find_element(By.CSS_SELECTOR, 'button').click()
-                time.sleep(1)
-            except NoSuchElementException:
-                pass
-            if not redo_successes:
-                try:
-                    element.find_element(By.CSS_SELECTOR, '.tds-bg_success')
-                    if content_text in ['Module', 'Project', 'Superbadge', 'Trail']:
-                        continue
-                except NoSuchElementException:
-                    pass
-            title_element = element.find_element(By.CSS_SELECTOR, 'h2')
-            title_text = title_element.text.strip()
-            link_text = None
-            try:
-                link_text = title_element.find_element(By.CSS_SELECTOR, 'a').get_property("href")
-            except NoSuchElementException:
-                pass
+        for index, panel in enumerate(trail['panels'], start=1):
+            content_text, title_text, link_text = panel['type'], panel['title'], panel['link']
+            if not redo_successes and panel['success'] and content_text in ['Module', 'Project', 'Superbadge', 'Trail']:
+                completed_links.add(link_text)
+                continue
             if content_text in ['Module', 'Project', 'Superbadge', 'Trail']:
                 content_dicts.append({'type': content_text, 'trail_title': trail_title, 'module_title': title_text, 'link': link_text})
             elif content_text in ['Task', 'Link']:
                 if link_text is None:
-                    exam_weight = element.find_element(By.CSS_SELECTOR, 'div > div > p').text.strip()
-                    content_dicts.append({'type': 'Exam Weight', 'trail_title': trail_title, 'module_title': title_text, 'link': exam_weight})
+                    content_dicts.append({'type': 'Exam Weight', 'trail_title': trail_title, 'module_title': title_text, 'link': panel['exam_weight']})
                 elif link_text.startswith('https://help.salesforce.com/articleView') or link_text.startswith('https://help.salesforce.com/s/article'):
                     content_dicts.append({'type': 'Article', 'trail_title': trail_title, 'module_title': title_text, 'link': link_text})
                 elif link_text.startswith('https://www.youtube.com/'):
@@ -344,184 +2111,313 @@ def scrape_trailhead(url, output_dir, audio_dir, speaker: Speaker, split_after=5
                     continue
                 else:
                     content_dicts.append({'type': 'Other', 'trail_title': trail_title, 'module_title': title_text, 'link': link_text})
-                    print(f'Unknown content type found at index: {str(_ + 1)}.')
+                    print(f'Unknown content type found at index: {str(index)}.')
         return content_dicts
 
-    def create_flashcard_dicts(trail_title, module_title, unit_title, page_contents):
-        html = ''
-        for element in page_contents:
-            html += re.sub(r'\s\s+', '', element.get_attribute('outerHTML').replace('\n', ''))
+    if browser is None:
+        start_browser(credentials)
+    http_fetcher = None
+    if http_fast_path:
+        http_fetcher = HttpUnitFetcher(browser.execute_cdp_cmd('Network.getAllCookies', {})['cookies'], browser.execute_script('return navigator.userAgent'), http_workers)
 
-        # this removes the navbar when scraping articles
-        html = re.sub(r'<nav.+</nav>', '', html)
-        # This removes a warning about screen readers struggling to parse the page content
-        html = re.sub(r'<div class="box message info"><div class="inner"><div class="bd"><div class="media"><img class="img mtm" role="presentation" src="https://res\.cloudinary\.com/hy4kyit2a/image/upload/doc/trailhead/en-usb473bb5ea1b7e61dfb07e6a7e547de6b\.gif" alt="Note"><div class="mediaBd"><div class="message-media-content"><h2 id="accessibility"><span>Accessibility</span></h2><p>This \S+ requires some additional instructions for screen reader users\. To access a detailed screen reader version of this \S+, click the link below:</p><p><a href="\S+" rel="noreferrer noopener" target="_blank">Open Trailhead screen reader instructions</a>\.</p></div></div></div></div></div></div>', '', html)
-        # These 3 removes the 'Follow along with an instructor/expert title, paragraph and video element
-        html = re.sub(r'<h2 id="follow-along-with-trail-together"><span>Follow Along with Trail Together</span></h2><p>Want to follow along with an \S+ as you work through this step\? Take a look at this video.+</p>(<p>|)<span><iframe width="\S+" height="\S+" src="\S+" allowfullscreen="" title="Video Content"></iframe></span>(<a id="hidden-content" href="#"></a>|)(</p>|)', '', html)
-        html = re.sub(r'<p>\(This clip starts at .+, in case you want to rewind and watch the beginning of the step again\.\)</p>', '', html)
-        html = re.sub(r'<h2 id="related-badges"><span>Related Badges</span></h2><p>Looking for more information\? Explore these related badges.+</p><table.+</tbody></table>', '', html)
-        # Remove the screen reader warning
-        html = re.sub(r'<h2 id="accessibility"><span>Accessibility</span></h2>This unit requires some additional instructions for screen reader users\. To access a detailed screen reader version of this unit, click the link below\.<br><br><a href="https://developer\.salesforce\.com/files/accessibility/session_based_perms/session_based_access/index\.html" target="_blank" rel="noreferrer noopener"><u>Open Trailhead screen reader instructions</u></a>', '', html)
+    def list_activities(url, visited_trails):
+        open_page(browser, url)
+        wait_for_element(browser, WAIT_TIMEOUT, By.CSS_SELECTOR, '#main-wrapper')
+        activities = []
+        if 'trailmixes' in browser.current_url:
+            activities = scrape_trail_links()
+            source_titles[url] = source_titles[browser.current_url]
+        elif browser.current_url.startswith('https://trailhead.salesforce.com/content/learn/trails/'):
+            activities = scrape_trail_links()
+            source_titles[url] = source_titles[browser.current_url]
+        elif browser.current_url.startswith('https://trailhead.salesforce.com/content/learn/modules/') or browser.current_url.startswith('https://trailhead.salesforce.com/content/learn/projects/'):
+            module_title = wait_for_element(browser, WAIT_TIMEOUT, By.CSS_SELECTOR, 'h1').text.strip()
+            source_titles[url] = module_title
+            units = browser.find_elements(By.CSS_SELECTOR, '.tds-content-panel__unit')
+            if units: activities.append({'type': 'Module', 'module_title': module_title, 'link': url})
+            else: activities.append({'type': 'Unit', 'link': url})
+        # TODO: Add support for scraping article and dev documentation as solo input, solo units and modules may not be working properly yet
+        # Trails inside a trailmix are flattened into it, so their modules land in the same CSV and get scheduled like any other
+        flattened = []
+        for content_dicts in activities:
+            if content_dicts['type'] != 'Trail':
+                flattened.append(content_dicts)
+            elif content_dicts['link'] not in visited_trails:
+                visited_trails.add(content_dicts['link'])
+                flattened.extend(list_activities(content_dicts['link'], visited_trails))
+        return flattened
 
+    def extract_unit(driver, unit_url):
+        open_page(driver, unit_url)
+        wait_for_element(driver, WAIT_TIMEOUT, By.CSS_SELECTOR, 'article > h1')
+        return run_script(driver, 'unit extraction', UNIT_EXTRACTION_SCRIPT)
 
-        html = add_br_around_img_tags(html, add_before=True, add_after=True)
-        trees = parse_trees(html)
-        flashcards = convert_trees_to_dicts(trees, split_on_trees=False, try_split_after=split_after)
-        for index, flashcard in enumerate(flashcards, start=1):
-            flashcard['trail_title'] = trail_title
-            flashcard['module_title'] = module_title
-            flashcard['unit_title'] = unit_title
-            flashcard['card_index'] = str(index)
+    def checkpointed_flashcards(link, load_page, trail_title, module_title, unit_title=None):
+        if checkpoint is not None:
+            entry = checkpoint.get_page(link, split_after)
+            if entry is not None:
+                return entry['page'], [dict(flashcard, trail_title=trail_title, module_title=module_title) for flashcard in entry['flashcards']]
+        page = load_page()
+        if checkpoint is not None:
+            entry = checkpoint.get_page(link, split_after, page)
+            if entry is not None:
+                checkpoint.put_page(link, split_after, page, entry['flashcards'])
+                return page, [dict(flashcard, trail_title=trail_title, module_title=module_title) for flashcard in entry['flashcards']]
+        flashcards = create_flashcard_dicts(trail_title, module_title, unit_title or page['title'], page['html'], split_after, page['url'] if page['challenge'] else None)
+        if checkpoint is not None:
+            checkpoint.put_page(link, split_after, page, flashcards)
+        return page, flashcards
 
-        try:
-            browser.find_element(By.CSS_SELECTOR, '#challenge')
-            flashcards[-1]['html'] += f'<a href="{browser.current_url}#challenge">Complete the Challenge!</a>'
-        except NoSuchElementException:
-            pass
-        return flashcards
+    def load_article(driver, link):
+        open_page(driver, link)
+        return wait_until(driver, WAIT_TIMEOUT, 'article content', lambda driver: driver.execute_script(ARTICLE_EXTRACTION_SCRIPT))
 
-    def write_flashcards(flashcards, speaker: Speaker):
-        name = flashcards[0]["trail_title"] if flashcards[0]["trail_title"] else flashcards[0]["module_title"] if flashcards[0]["module_title"] else flashcards[0]["unit_title"]
-        with open(file=f'{output_dir}{name}.csv', mode='w', encoding='utf-8') as file:
-            for index, flashcard in enumerate(flashcards, start=1):
-                print(f'Writing cards: {index} of {len(flashcards)}')
-                audio = False
-                filepath = f'{safe_filename(flashcard["unit_title"] + '_' + flashcard["card_index"])}.wav'
-                if speaker is not None:
-                    if os.path.isfile(f'{audio_dir}{filepath}'):
-                        audio = True
-                    else:
-                        try:
-                            speaker.generate_speech(f'{audio_dir}{filepath}', flashcard['text'])
-                            audio = True
-                        except Exception as e:
-                            print(f'Audio generation failed for {filepath}! You will need to rerun the script to retry it (existing audio files will not be recreated).', e)
-                            if os.path.isfile(f'{audio_dir}{filepath}'):
-                                os.remove(f'{audio_dir}{filepath}')
-                file.write(
-                    f'{flashcard["trail_title"] + ' > ' if flashcard["trail_title"] else ''}{flashcard["module_title"] + ' > ' if flashcard["module_title"] else ''}{flashcard["unit_title"]}: {flashcard["card_index"]}\t' +
-                    f'{flashcard["html"]}\t' +
-                    (f'<audio controls=""><source src="{filepath}" type="audio/wav"></audio>' if audio else '') + '\t' +
-                    (f'[sound:{filepath}]' if audio else '') + '\t' +
-                    f'Incremental_Learning::Salesforce::{'Trail::' + flashcard["trail_title"].replace(' ', '_') + '::' if flashcard["trail_title"] else ''}{('Module::' + (flashcard["module_index"] + '_' if flashcard["module_index"] else '') + (flashcard["module_title"].replace(' ', '_') + '::' if flashcard["module_title"] else '') if flashcard["module_title"] else "")}{('Unit::' + (flashcard["unit_index"] + '_' if flashcard["unit_index"] else '') + (flashcard["unit_title"].replace(' ', '_') if flashcard["unit_title"] else '')) if flashcard["unit_title"] else ""}{'::' + flashcard["card_index"] if flashcard["card_index"] else ''}\n'
-                )
-
-    if browser is None:
-        browser = undetected_chromedriver.Chrome()
-        browser.maximize_window()
-        browser.get('https://trailhead.salesforce.com/')
-        if credentials is not None:
-            login_trailhead()
-        else:
-            input('Please log in, then press the enter key in the terminal!')
-    browser.get(url)
-    wait_for_element(browser, 30, By.CSS_SELECTOR, '#main-wrapper')
-    activities = []
-    if 'trailmixes' in browser.current_url:
-        activities = scrape_trail_links()
-    elif browser.current_url.startswith('https://trailhead.salesforce.com/content/learn/trails/'):
-        activities = scrape_trail_links()
-    elif browser.current_url.startswith('https://trailhead.salesforce.com/content/learn/modules/') or browser.current_url.startswith('https://trailhead.salesforce.com/content/learn/projects/'):
-        module_title = wait_for_element(browser, 30, By.CSS_SELECTOR, 'h1').text.strip()
-        units = browser.find_elements(By.CSS_SELECTOR, '.tds-content-panel__unit')
-        if units: activities.append({'type': 'Module', 'module_title': module_title, 'link': url})
-        else: activities.append({'type': 'Unit', 'link': url})
-    # TODO: Add support for scraping article and dev documentation as solo input, solo units and modules may not be working properly yet
-
-    flashcards = []
-    for module_order, content_dicts in enumerate(activities, start=1):
-        completed = False
-        while not completed:
+    def scrape_activity(driver, module_order, content_dicts):
+        flashcards = []
+        content_dicts.setdefault("trail_title", "")
+        content_dicts.setdefault("module_index", "")
+        content_dicts.setdefault("module_title", "")
+        content_dicts.setdefault("unit_index", "")
+        content_dicts.setdefault("unit_title", "")
+        content_dicts.setdefault("card_index", "")
+        if content_dicts['type'] == 'Exam Weight':
+            flashcard = {'trail_title': content_dicts["trail_title"], 'module_index': str(module_order), 'module_title': content_dicts["module_title"], 'unit_index': "1", 'unit_title': 'Exam Weight', 'card_index': "1", 'text': f'{content_dicts["module_title"]}: {content_dicts["link"]}', 'html': content_dicts['link']}
+            flashcards.append(flashcard)
+        elif content_dicts['type'] == 'Article':
             try:
-                print(f'Scraping content: {module_order} of {len(activities)}')
-                content_dicts.setdefault("trail_title", "")
-                content_dicts.setdefault("module_index", "")
-                content_dicts.setdefault("module_title", "")
-                content_dicts.setdefault("unit_index", "")
-                content_dicts.setdefault("unit_title", "")
-                content_dicts.setdefault("card_index", "")
-                if content_dicts['type'] == 'Exam Weight':
-                    flashcard = {'trail_title': content_dicts["trail_title"], 'module_index': str(module_order), 'module_title': content_dicts["module_title"], 'unit_index': "1", 'unit_title': 'Exam Weight', 'card_index': "1", 'text': f'{content_dicts["module_title"]}: {content_dicts["link"]}', 'html': content_dicts['link']}
-                    flashcards.append(flashcard)
-                elif content_dicts['type'] == 'Article':
-                    browser.get(content_dicts['link'])
-                    try:
-                        wait_for_element(browser, 30, By.CSS_SELECTOR, 'html')
-                        body = wait_for_element(browser, 30, By.CSS_SELECTOR, 'body')
-                        shadow_root = browser.execute_script('return arguments[0].shadowRoot', wait_for_element(body, 30, By.CSS_SELECTOR, 'c-hc-article-viewer'))
-                        shadow_root = wait_for_element(shadow_root, 30, By.CSS_SELECTOR, 'div')
-                        shadow_root = browser.execute_script('return arguments[0].shadowRoot', wait_for_element(shadow_root, 30, By.CSS_SELECTOR, 'c-hc-documentation-article'))
-                        content = shadow_root.find_element(By.CSS_SELECTOR, 'div > div > content > div > div')
-                        units_elements = content.find_elements(By.XPATH, '*')
-                        for flashcard in create_flashcard_dicts(content_dicts["trail_title"], content_dicts["module_title"], 'Article', units_elements):
-                            flashcard["module_index"] = str(module_order)
-                            flashcard["unit_index"] = "1"
-                            flashcards.append(flashcard)
-                    except (StaleElementReferenceException, TimeoutException):
-                        if browser.current_url.startswith('https://developer.salesforce.com/docs/'):
-                            flashcard = {'trail_title': content_dicts["trail_title"], 'module_title': content_dicts["module_title"], 'unit_title': 'Docs', 'text': 'Please review the following documentation.', 'html': f'<a href="{content_dicts['link']}">Go to Docs!</a>', "module_index": str(module_order), "unit_index": "1", "card_index": "1"}
-                            flashcards.append(flashcard)
-                        elif browser.current_url.startswith('https://help.salesforce.com/s/articleView'):
-                            flashcard = {'trail_title': content_dicts["trail_title"], 'module_title': content_dicts["module_title"], 'unit_title': 'Article', 'text': 'Please review the following article.', 'html': f'<a href="{content_dicts['link']}">Go to Article!</a>', "module_index": str(module_order), "unit_index": "1", "card_index": "1"}
-                            flashcards.append(flashcard)
-                        else:
-                            raise Exception('Could not recover from error when parsing Article.')
-                elif content_dicts['type'] == 'Superbadge':
-                    flashcard = {'trail_title': content_dicts["trail_title"], 'module_title': content_dicts["module_title"], 'unit_title': 'Exam Weight', 'text': f'Please complete the superbadge!', 'html': f'<a href="{content_dicts['link']}">Go to Superbadge!</a>'}
+                _, article_flashcards = checkpointed_flashcards(content_dicts['link'], lambda: load_article(driver, content_dicts['link']), content_dicts["trail_title"], content_dicts["module_title"], 'Article')
+                for flashcard in article_flashcards:
                     flashcard["module_index"] = str(module_order)
                     flashcard["unit_index"] = "1"
-                    flashcard["card_index"] = "1"
                     flashcards.append(flashcard)
-                elif content_dicts['type'] == 'Trail':
-                    flashcards.extend(scrape_trailhead(content_dicts['link'], False, False, redo_successes))
-                elif content_dicts['type'] in ['Module', 'Project']:
-                    browser.get(content_dicts['link'])
-                    unit_links = []
-                    units_elements = browser.find_elements(By.CSS_SELECTOR, 'a.tds-content-panel__unit-link')
-                    for element in units_elements:
-                        unit_links.append(f'{element.get_property("href")}')
-                    for unit_order, unit in enumerate(unit_links, start=1):
-                        browser.get(unit)
-                        unit_title = wait_for_element(browser, 30, By.CSS_SELECTOR, 'article > h1').text.strip()
-                        unit_contents = browser.find_elements(By.CSS_SELECTOR, 'article > .unit-content > *')
-                        for flashcard in create_flashcard_dicts(content_dicts["trail_title"], content_dicts["module_title"], unit_title, unit_contents):
-                            flashcard["module_index"] = str(module_order)
-                            flashcard["unit_index"] = str(unit_order)
-                            flashcards.append(flashcard)
-                elif content_dicts['type'] in ['Unit']:
-                    navs = browser.find_elements(By.CSS_SELECTOR, 'nav > ol > li')
-                    trail_title, module_title = '', ''
-                    if navs:
-                        if len(navs) == 3:
-                            trail_title = navs[0].find_element(By.CSS_SELECTOR, 'a').text.strip()
-                            module_title = navs[1].find_element(By.CSS_SELECTOR, 'a').text.strip()
-                        elif len(navs) == 2:
-                            module_title = navs[0].find_element(By.CSS_SELECTOR, 'a').text.strip()
-                    unit_title = wait_for_element(browser, 30, By.CSS_SELECTOR, 'article > h1').text.strip()
-                    unit_contents = browser.find_elements(By.CSS_SELECTOR, 'article > .unit-content > *')
-                    for flashcard in create_flashcard_dicts(trail_title, module_title, unit_title, unit_contents):
-                        flashcard["module_index"] = str(module_order)
-                        flashcard["unit_index"] = str(1)
-                        flashcards.append(flashcard)
-                    pass
-                elif content_dicts['type'] == 'YouTube':
-                    flashcard = {'trail_title': content_dicts["trail_title"], 'module_title': content_dicts["module_title"], 'unit_title': 'YouTube', 'text': 'Please watch the following video.', 'html': f'<a href="{content_dicts['link']}">Watch the Video!</a>', "module_index": str(module_order), "unit_index": "1", "card_index": "1"}
+            except (StaleElementReferenceException, TimeoutException):
+                if driver.current_url.startswith('https://developer.salesforce.com/docs/'):
+                    flashcard = {'trail_title': content_dicts["trail_title"], 'module_title': content_dicts["module_title"], 'unit_title': 'Docs', 'text': 'Please review the following documentation.', 'html': f'<a href="{content_dicts['link']}">Go to Docs!</a>', "module_index": str(module_order), "unit_index": "1", "card_index": "1"}
+                    flashcards.append(flashcard)
+                elif driver.current_url.startswith('https://help.salesforce.com/s/articleView'):
+                    flashcard = {'trail_title': content_dicts["trail_title"], 'module_title': content_dicts["module_title"], 'unit_title': 'Article', 'text': 'Please review the following article.', 'html': f'<a href="{content_dicts['link']}">Go to Article!</a>', "module_index": str(module_order), "unit_index": "1", "card_index": "1"}
                     flashcards.append(flashcard)
                 else:
-                    flashcard = {'trail_title': content_dicts["trail_title"], 'module_title': content_dicts["module_title"], 'unit_title': 'Other', 'text': 'Please review the following content.', 'html': f'<a href="{content_dicts['link']}">Go to Content!</a>', "module_index": str(module_order), "unit_index": "1", "card_index": "1"}
+                    raise Exception('Could not recover from error when parsing Article.')
+        elif content_dicts['type'] == 'Superbadge':
+            flashcard = {'trail_title': content_dicts["trail_title"], 'module_title': content_dicts["module_title"], 'unit_title': 'Exam Weight', 'text': f'Please complete the superbadge!', 'html': f'<a href="{content_dicts['link']}">Go to Superbadge!</a>'}
+            flashcard["module_index"] = str(module_order)
+            flashcard["unit_index"] = "1"
+            flashcard["card_index"] = "1"
+            flashcards.append(flashcard)
+        elif content_dicts['type'] in ['Module', 'Project']:
+            unit_links = checkpoint.get_links(content_dicts['link']) if checkpoint is not None else None
+            if unit_links is None:
+                open_page(driver, content_dicts['link'])
+                wait_for_element(driver, WAIT_TIMEOUT, By.CSS_SELECTOR, 'a.tds-content-panel__unit-link')
+                unit_links = run_script(driver, 'module unit links', MODULE_UNIT_LINKS_SCRIPT)
+                # An empty list would skip the module on every run until the checkpoint expires
+                if checkpoint is not None and unit_links:
+                    checkpoint.put_links(content_dicts['link'], unit_links)
+            pages = {}
+            if http_fetcher is not None:
+                missing_links = [unit for unit in unit_links if checkpoint is None or checkpoint.get_page(unit, split_after, count=False) is None]
+                pages = dict(zip(missing_links, http_fetcher.fetch_all(missing_links)))
+            for unit_order, unit in enumerate(unit_links, start=1):
+                _, unit_flashcards = checkpointed_flashcards(unit, lambda: pages.get(unit) or extract_unit(driver, unit), content_dicts["trail_title"], content_dicts["module_title"])
+                for flashcard in unit_flashcards:
+                    flashcard["module_index"] = str(module_order)
+                    flashcard["unit_index"] = str(unit_order)
                     flashcards.append(flashcard)
-                completed = True
-            except Exception as e:
-                print(e)
-                pass
+        elif content_dicts['type'] in ['Unit']:
+            page, unit_flashcards = checkpointed_flashcards(content_dicts['link'], lambda: extract_unit(driver, content_dicts['link']), '', '')
+            navs = page['breadcrumbs']
+            trail_title, module_title = '', ''
+            if len(navs) == 3:
+                trail_title, module_title = navs[0], navs[1]
+            elif len(navs) == 2:
+                module_title = navs[0]
+            for flashcard in unit_flashcards:
+                flashcard["trail_title"] = trail_title
+                flashcard["module_title"] = module_title
+                flashcard["module_index"] = str(module_order)
+                flashcard["unit_index"] = str(1)
+                flashcards.append(flashcard)
+        elif content_dicts['type'] == 'YouTube':
+            flashcard = {'trail_title': content_dicts["trail_title"], 'module_title': content_dicts["module_title"], 'unit_title': 'YouTube', 'text': 'Please watch the following video.', 'html': f'<a href="{content_dicts['link']}">Watch the Video!</a>', "module_index": str(module_order), "unit_index": "1", "card_index": "1"}
+            flashcards.append(flashcard)
+        else:
+            flashcard = {'trail_title': content_dicts["trail_title"], 'module_title': content_dicts["module_title"], 'unit_title': 'Other', 'text': 'Please review the following content.', 'html': f'<a href="{content_dicts['link']}">Go to Content!</a>', "module_index": str(module_order), "unit_index": "1", "card_index": "1"}
+            flashcards.append(flashcard)
+        return flashcards
 
-    write_flashcards(flashcards, speaker)
+    def timed_scrape_activity(driver, module_order, content_dicts):
+        with RUN_METRICS.timer(f'scrape {content_dicts["type"]}'):
+            return scrape_activity(driver, module_order, content_dicts)
 
-    return flashcards
+    def scrape_activity_with_retries(driver, module_order, content_dicts, total):
+        # Returns None once every attempt failed (or the host's circuit breaker is open), the caller dead letters it
+        print(f'Scraping content: {module_order} of {total}')
+        if content_dicts['type'] not in BROWSER_ACTIVITY_TYPES:
+            return timed_scrape_activity(driver, module_order, content_dicts)
+        host = urllib.parse.urlsplit(content_dicts['link'] or '').hostname or 'trailhead.salesforce.com'
+        try:
+            return retry_policy.run(host, lambda: timed_scrape_activity(driver, module_order, content_dicts), f'Scraping content {module_order} of {total}', lambda error, delay: RUN_METRICS.count('scrape retries'))
+        except Exception as e:
+            print(f'Giving up on {content_dicts["link"]}, the rest of the run carries on without it.', e)
+            RUN_METRICS.count('scrape failures')
+            failures[content_dicts['link']] = e
+            return None
+
+    def scrape_in_parallel(jobs):
+        work = queue.PriorityQueue()
+        for job in jobs:
+            work.put(job)
+        drivers = [browser]
+
+        def worker(driver):
+            while True:
+                try:
+                    (source_index, module_order), link = work.get_nowait()
+                except queue.Empty:
+                    return
+                flashcards = scrape_activity_with_retries(driver, module_order, jobs_by_link[link], len(sources[source_index]))
+                with results_ready:
+                    results[link] = flashcards
+                    results_ready.notify_all()
+
+        try:
+            # Each worker browser is kept as soon as it starts, so the ones already open are quit if a later one fails
+            for _ in range(min(scrape_workers, len(jobs)) - 1):
+                try:
+                    drivers.append(open_worker_browser(browser))
+                except Exception as e:
+                    print(f'Could not start another browser, scraping with {len(drivers)}.', e)
+                    break
+            with ThreadPoolExecutor(max_workers=len(drivers)) as pool:
+                list(pool.map(worker, drivers))
+        finally:
+            for driver in drivers[1:]:
+                driver.quit()
+
+    def shared_flashcards(module_order, content_dicts, total):
+        # A job scraped for another source carries that source's trail, module title and position
+        link = content_dicts['link']
+        if parallel_thread is not None:
+            with results_ready:
+                results_ready.wait_for(lambda: link in results or not parallel_thread.is_alive())
+        if link not in results:
+            results[link] = scrape_activity_with_retries(browser, module_order, content_dicts, total)
+        if results[link] is None:
+            return None
+        return [dict(flashcard, trail_title=content_dicts.get('trail_title', ''), module_title=content_dicts.get('module_title', ''), module_index=str(module_order)) for flashcard in results[link]]
+
+    def scrape_flashcards(url, activities):
+        # Yields each activity's flashcards in module_order as soon as they (and everything before them) are scraped
+        for module_order, content_dicts in enumerate(activities, start=1):
+            # A retried activity keeps its position from the original run
+            module_order = content_dicts.get('module_order', module_order)
+            if content_dicts['type'] in PARALLEL_ACTIVITY_TYPES:
+                flashcards = shared_flashcards(module_order, content_dicts, len(activities))
+            else:
+                if parallel_thread is not None and content_dicts['type'] == 'Unit':
+                    # Units are scraped with the global browser, which is one of the pool's drivers
+                    parallel_thread.join()
+                flashcards = scrape_activity_with_retries(browser, module_order, content_dicts, len(activities))
+            if flashcards is None:
+                if dead_letters is not None:
+                    dead_letters.add_activity(url, original_titles.get(url, ''), module_order, content_dicts, failures[content_dicts['link']])
+                flashcards = []
+            elif dead_letters is not None:
+                dead_letters.resolve_activity(original_titles.get(url, ''), content_dicts['link'])
+            yield flashcards
+
+    # Nested trails are flattened into their trailmix, so the CSV is named after the page that was asked for
+    source_titles = {}
+    completed_links = set()
+    failures = {}
+    retried_cards = {}
+    if retry_dead_letters:
+        # The dead letters are grouped by the CSV they belong in, each one is dropped from the list as it succeeds
+        entries = dead_letters.pending() if dead_letters is not None else []
+        urls = list(dict.fromkeys(entry['source_title'] for entry in entries))
+        sources = [[entry['activity'] for entry in entries if entry['source_title'] == title and entry['kind'] == 'activity'] for title in urls]
+        retried_cards = {title: [entry['flashcard'] for entry in entries if entry['source_title'] == title and entry['kind'] == 'audio'] for title in urls}
+        original_titles = {title: title for title in urls}
+        source_titles = {title: f'{title} (retried)' for title in urls}
+        incremental_sync = False
+        print(f'Retrying {len(entries)} dead letters from {len(urls)} sources')
+    else:
+        sources = [list_activities(url, {url}) for url in urls]
+        original_titles = source_titles
+    # One job per distinct module, project or article, queued by the first source (and position) that needs it
+    jobs_by_link, parallel_jobs = {}, []
+    for source_index, activities in enumerate(sources):
+        for module_order, content_dicts in enumerate(activities, start=1):
+            module_order = content_dicts.get('module_order', module_order)
+            if content_dicts['type'] in PARALLEL_ACTIVITY_TYPES and content_dicts['link'] not in jobs_by_link:
+                jobs_by_link[content_dicts['link']] = content_dicts
+                parallel_jobs.append(((source_index, module_order), content_dicts['link']))
+    shared = sum(1 for activities in sources for content_dicts in activities if content_dicts['type'] in PARALLEL_ACTIVITY_TYPES) - len(parallel_jobs)
+    if len(sources) > 1:
+        print(f'Scheduled {len(parallel_jobs)} modules, projects and articles for {len(sources)} sources ({shared} shared between them are scraped once)')
+    results = {}
+    results_ready = threading.Condition()
+    parallel_thread = None
+    if scrape_workers > 1 and len(parallel_jobs) > 1:
+        parallel_thread = threading.Thread(target=scrape_in_parallel, args=(parallel_jobs,), daemon=True)
+        parallel_thread.start()
+
+    # The CSVs share one synthesis pool and job list, so a card shared between sources is only synthesized once
+    tts_pool = ThreadPoolExecutor(max_workers=max(1, tts_workers))
+    audio_jobs = {}
+    source_flashcards = []
+    try:
+        for url, activities in zip(urls, sources):
+            flashcards = []
+            sync = SourceSync(checkpoint, url) if incremental_sync else None
+            writer = FlashcardWriter(output_dir, audio_dir, speaker, audio_cache, tts_workers, started, audio_jobs, tts_pool, source_titles.get(url), incremental_sync, dead_letters, original_titles.get(url))
+            try:
+                if retried_cards.get(url):
+                    flashcards.extend(retried_cards[url])
+                    writer.add(retried_cards[url])
+                for content_dicts, activity_flashcards in zip(activities, scrape_flashcards(url, activities)):
+                    flashcards.extend(activity_flashcards)
+                    writer.add(activity_flashcards, sync.compare(content_dicts, activity_flashcards) if sync is not None else None)
+                if sync is not None:
+                    # The units of a failed activity are carried over like skipped ones instead of being reported as removed
+                    writer.write_removed(sync.finish(completed_links | set(failures)))
+            finally:
+                writer.close()
+            if sync is not None:
+                print(sync.summary())
+            source_flashcards.append(flashcards)
+        if parallel_thread is not None:
+            parallel_thread.join()
+    finally:
+        tts_pool.shutdown()
+    if http_fetcher is not None:
+        print(http_fetcher.summary())
+    if checkpoint is not None:
+        print(checkpoint.summary())
+    if retry_policy.summary():
+        print(retry_policy.summary())
+
+    return source_flashcards
+
+
+def scrape_trailhead(url, output_dir, audio_dir, speaker: Speaker, split_after=500, credentials=None, redo_successes=False, tts_workers=4, audio_cache: AudioCache = None, scrape_workers=1, http_fast_path=False, http_workers=8, checkpoint: CheckpointStore = None, incremental_sync=False):
+    return scrape_sources([url], output_dir, audio_dir, speaker, split_after, credentials, redo_successes, tts_workers, audio_cache, scrape_workers, http_fast_path, http_workers, checkpoint, incremental_sync)[0]
+
+
+def read_urls(url='', urls=(), urls_file=''):
+    # urls_file holds one URL per line, blank lines and lines starting with # are skipped
+    all_urls = ([url] if url else []) + list(urls)
+    if urls_file:
+        with open(urls_file, encoding='utf-8') as file:
+            all_urls += [line.strip() for line in file if line.strip() and not line.strip().startswith('#')]
+    return list(dict.fromkeys(all_urls))
 
 
 def run(
     url='',
+    urls=(),
+    urls_file='',
     csv_output_dir='.',
     audio_output_dir=r'.',
     redo_completed=False,
@@ -531,17 +2427,115 @@ def run(
     open_ai_key='',
     azure_key='',
     azure_region='',
+    local_tts_engine='espeak-ng',
+    piper_model='',
     log_into_google=False,
     google_username='',
-    google_password=''
+    google_password='',
+    tts_workers=4,
+    tts_requests_per_minute=0,
+    tts_max_attempts=5,
+    scrape_max_attempts=4,
+    circuit_breaker_failures=3,
+    circuit_breaker_cooldown=120,
+    dead_letter_file='',
+    retry_dead_letters=False,
+    tts_ssml_batch_size=0,
+    tts_ssml_batch_max_chars=200,
+    tts_chunk_workers=4,
+    audio_format='',
+    audio_bitrate=0,
+    audio_sample_rate=0,
+    use_tts_cache=True,
+    tts_cache_dir='',
+    tts_cache_max_mb=2048,
+    strip_rules_file='',
+    scrape_workers=1,
+    http_fast_path=False,
+    http_workers=8,
+    use_checkpoint=True,
+    checkpoint_file='',
+    checkpoint_max_age_hours=168,
+    wait_timeout=30,
+    wait_poll_interval=0.1,
+    dom_quiet_ms=300,
+    incremental_sync=False,
+    persist_session=True,
+    browser_profile_dir='',
+    session_file='',
+    save_metrics=True,
+    metrics_file='',
+    profile_file=''
 ):
+    # run_daemon calls this once per URL, so every report only covers its own run
+    RUN_METRICS.reset()
+    WAIT_TELEMETRY.reset()
+    STRIP_RULES.reset()
+    # cProfile only sees the thread that enabled it, so this covers navigation and parsing but not the TTS and scrape pools
+    profiler = cProfile.Profile() if profile_file else None
+    if profiler is not None:
+        profiler.enable()
+    configure_waits(wait_timeout, wait_poll_interval, dom_quiet_ms)
+    if strip_rules_file:
+        STRIP_RULES.load(strip_rules_file)
     speaker = None
-    if generate_tts and tts_service in ['OpenAI','Azure']:
-        speaker = Speaker(tts_service, open_ai_key=open_ai_key, azure_key=azure_key, azure_region=azure_region)
+    if generate_tts and tts_service in TTS_BACKENDS:
+        speaker = Speaker(tts_service, open_ai_key=open_ai_key, azure_key=azure_key, azure_region=azure_region, requests_per_minute=tts_requests_per_minute, max_attempts=tts_max_attempts, audio_format=audio_format, audio_bitrate=audio_bitrate, audio_sample_rate=audio_sample_rate, ssml_batch_size=tts_ssml_batch_size, ssml_batch_max_chars=tts_ssml_batch_max_chars, chunk_workers=tts_chunk_workers, circuit_breaker_failures=circuit_breaker_failures, circuit_breaker_cooldown=circuit_breaker_cooldown, local_engine=local_tts_engine, piper_model=piper_model)
     if not csv_output_dir.endswith('/'):
         csv_output_dir += '/'
     if not audio_output_dir.endswith('/'):
         audio_output_dir += '/'
-    flashcards = scrape_trailhead(url, csv_output_dir, audio_output_dir, speaker, split_after_x_chars, {'username': google_username, 'password': google_password} if log_into_google else None, redo_completed)
-    for count, flashcard in enumerate(flashcards, start=1):
+    audio_cache = None
+    if speaker is not None and use_tts_cache:
+        audio_cache = AudioCache(tts_cache_dir or f'{csv_output_dir}.tts_cache', tts_cache_max_mb * 1024 * 1024)
+    checkpoint = None
+    if incremental_sync and not use_checkpoint:
+        raise Exception('incremental_sync keeps its fingerprints in the checkpoint, please set use_checkpoint=True.')
+    if use_checkpoint:
+        # A sync has to look at every page again, unchanged pages still reuse their stored flashcards through the content hash
+        checkpoint = CheckpointStore(checkpoint_file or f'{csv_output_dir}.trailhead_checkpoint.sqlite', 0 if incremental_sync else checkpoint_max_age_hours)
+    retry_policy = RetryPolicy(scrape_max_attempts, failure_threshold=circuit_breaker_failures, cooldown=circuit_breaker_cooldown)
+    dead_letters = DeadLetters(dead_letter_file or f'{csv_output_dir}.dead_letters.json')
+    credentials = {'username': google_username, 'password': google_password} if log_into_google else None
+    if persist_session:
+        session_file = session_file or f'{csv_output_dir}.trailhead_session.json'
+        start_browser(credentials, browser_profile_dir or f'{csv_output_dir}.chrome_profile', session_file)
+    source_flashcards = scrape_sources(read_urls(url, urls, urls_file), csv_output_dir, audio_output_dir, speaker, split_after_x_chars, credentials, redo_completed, tts_workers, audio_cache, scrape_workers, http_fast_path, http_workers, checkpoint, incremental_sync, retry_policy, dead_letters, retry_dead_letters)
+    for count, flashcard in enumerate([flashcard for flashcards in source_flashcards for flashcard in flashcards], start=1):
         print(f'{str(count)}: {str(flashcard)}')
+    print(STRIP_RULES.summary())
+    print(WAIT_TELEMETRY.summary())
+    if speaker is not None:
+        print(speaker.summary())
+    if checkpoint is not None:
+        checkpoint.close()
+    if audio_cache is not None:
+        audio_cache.save()
+        print(audio_cache.summary())
+    print(dead_letters.summary())
+    if persist_session and browser is not None:
+        save_session(browser, session_file)
+    if profiler is not None:
+        profiler.disable()
+        profiler.dump_stats(profile_file)
+        print(f'Profile written to {profile_file}, open it with python -m pstats or snakeviz.')
+    print(RUN_METRICS.summary())
+    if save_metrics:
+        metrics_file = metrics_file or f'{csv_output_dir}.run_metrics.json'
+        RUN_METRICS.save(metrics_file)
+        print(f'Run metrics written to {metrics_file}')
+
+
+def run_daemon(**kwargs):
+    # Keeps one logged in browser open and runs every URL typed or piped in, an empty line or EOF stops it
+    print('Enter a Trailmix, Trail or Module URL per line, an empty line quits.')
+    for line in sys.stdin:
+        url = line.strip()
+        if not url:
+            break
+        try:
+            run(url=url, **kwargs)
+        except Exception as e:
+            print(e)
+    # run() already saved the session after each URL
+    close_browser()
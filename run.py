@@ -1,17 +1,56 @@
 import code
 
+# Swap code.run for code.run_daemon (and drop url) to keep one logged in browser open and paste URLs one per line
 code.run(
     url='',  # Trailmix, Trail or Module URL
+    urls=[],  # More URLs to scrape in the same run, each gets its own CSV and modules they share are only scraped once
+    urls_file='',  # Optional text file with one URL per line (lines starting with # are ignored)
     csv_output_dir='.',  # . to generate output in this directory
     audio_output_dir=r'.',  # E.g. your anki media directory
     split_after_x_chars=500,  # Attempts to split after X (before new 'sections'), just increase the number to a huge amount to ensure each unit is one card each
     redo_completed=False,  # Should it skip tiles that have a green tick already? (On trails)
+    scrape_workers=1,  # Extra Chrome windows (sharing your login) that scrape modules in parallel, the CSV order is unaffected
+    http_fast_path=False,  # Downloads unit pages directly with your login cookies, falling back to Chrome when a page has no content
+    http_workers=8,  # Concurrent downloads for the fast path
+    use_checkpoint=True,  # Saves every scraped page so a crashed or repeated run picks up where it stopped
+    checkpoint_file='',  # Defaults to .trailhead_checkpoint.sqlite in the csv output directory
+    checkpoint_max_age_hours=168,  # Pages older than this are scraped again (set to 0 to always re-scrape)
+    incremental_sync=False,  # Checks every page for changes and also writes <name>.delta.csv with only the added or changed cards (plus <name>.removed.txt)
+    wait_timeout=30,  # Seconds to wait for an element before giving up on a page
+    wait_poll_interval=0.1,  # Seconds between checks while waiting for an element
+    dom_quiet_ms=300,  # A page counts as loaded once its DOM and network requests have been quiet for this long
+    persist_session=True,  # Keeps the Chrome profile and login cookies so later runs skip logging in while the session is valid
+    browser_profile_dir='',  # Defaults to .chrome_profile in the csv output directory
+    session_file='',  # Defaults to .trailhead_session.json in the csv output directory, it holds your login cookies so keep it private
 
     generate_tts=True,
-    tts_service='OpenAI',  # OpenAI or Azure
+    tts_service='OpenAI',  # OpenAI, Azure, Local (espeak-ng or piper installed on this machine, free and offline) or Fake (offline test audio, a tone per card instead of speech)
     open_ai_key='',
     azure_key='',
     azure_region='',
+    local_tts_engine='espeak-ng',  # espeak-ng or piper, used when tts_service is Local
+    piper_model='',  # Path of a piper voice .onnx file (its .onnx.json must sit next to it)
+    tts_workers=4,  # How many cards are synthesized in parallel, the CSV order is unaffected
+    tts_requests_per_minute=0,  # 0 uses the provider default (50 for OpenAI, 12000 for Azure), lower it if you hit rate limits
+    tts_max_attempts=5,  # Failed or rate limited requests are retried with an exponential backoff
+    scrape_max_attempts=4,  # Attempts per module, article or unit before it is skipped and added to the dead letters
+    circuit_breaker_failures=3,  # After this many pages (or clips) in a row failed for good, the site (or TTS provider) is given a rest
+    circuit_breaker_cooldown=120,  # Seconds that rest lasts, calls in the meantime fail straight away and go to the dead letters
+    dead_letter_file='',  # Defaults to .dead_letters.json in the csv output directory, it lists what failed and is removed once nothing has
+    retry_dead_letters=False,  # Only retries the dead letters (url is ignored) and writes the recovered cards to "<name> (retried).csv"
+    tts_ssml_batch_size=0,  # Azure only, synthesizes up to this many short cards (e.g. Exam Weight and link cards) in one request, 0 turns it off
+    tts_ssml_batch_max_chars=200,  # Cards longer than this are never batched
+    tts_chunk_workers=4,  # Long cards are split at sentence boundaries and this many chunks of one card are synthesized at once
+    audio_format='',  # mp3, opus, ogg or wav, empty keeps the original .wav files (OpenAI's are really MP3s)
+    audio_bitrate=0,  # kbps, 0 for the provider default, settings the provider can't produce itself are encoded with ffmpeg
+    audio_sample_rate=0,  # Hz, 0 for the provider default (24000)
+    use_tts_cache=True,  # Reuses audio for identical card text instead of synthesizing (and paying for) it again
+    tts_cache_dir='',  # Defaults to .tts_cache in the csv output directory
+    tts_cache_max_mb=2048,  # Least recently used clips are removed from the cache above this size
+    strip_rules_file='',  # Optional JSON list of {"name": ..., "pattern": ...} regexes for extra Trailhead boilerplate to remove from cards
+    save_metrics=True,  # Writes time per stage (page loads, parsing, TTS requests, file writes), TTS characters and an estimated cost per provider
+    metrics_file='',  # Defaults to .run_metrics.json in the csv output directory, a name ending in .csv writes a CSV instead
+    profile_file='',  # Optional cProfile dump of the main thread, e.g. run.prof
 
     log_into_google=True,  # If you select No, the code will wait for you to log in and confirm when you're done
     google_username='',